@@ -1,31 +1,95 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains.retrieval_qa.base import RetrievalQA
+from pydantic import BaseModel
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import PromptTemplate
+from langchain_community.docstore.base import AddableMixin, Docstore
 import os
-import fitz
+import re
+import numpy as np
 from dotenv import load_dotenv
 import logging
-from langchain_community.vectorstores import FAISS
-import firebase_admin
-from firebase_admin import credentials, firestore
 from functools import lru_cache
+from contextlib import contextmanager
 import asyncio
-from typing import List
+import bisect
+from typing import TYPE_CHECKING, List, Optional
 import concurrent.futures
+import contextvars
+import multiprocessing
+import threading
 import hashlib
+import heapq
+import json
+import math
+import random
+import shutil
+import tempfile
 import time
+import uuid
 from pathlib import Path
+from collections import OrderedDict
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process index lock, run a single worker
+    fcntl = None
+
+# Heavy dependencies (torch, FAISS, PyMuPDF, firebase-admin, Gemini client) are imported where they are
+# first used, so importing this module stays fast; the startup warmup pulls them in off the request path
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+    from langchain_huggingface import HuggingFaceEmbeddings
 # Load environment variables
 load_dotenv()
 
 app = FastAPI(title="RAG Chatbot API", version="1.0.0")
 
+class UploadSizeLimitMiddleware:
+    """Reject oversized uploads before Starlette spools the multipart body to disk: at once from
+    Content-Length, or as soon as a body sent without one grows past the limit"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = _upload_request_limit(scope)
+        if limit is None:
+            return await self.app(scope, receive, send)
+        detail = f"Upload exceeds the request limit of {limit} bytes"
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": detail}, headers={"Connection": "close"})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing, so this becomes the 413 response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def _upload_request_limit(scope) -> Optional[int]:
+    if scope["type"] != "http" or scope["method"] != "POST":
+        return None
+    if scope["path"] == "/upload-pdf":
+        return MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+    if scope["path"] == "/upload-pdfs":
+        return MAX_BATCH_UPLOAD_BYTES
+    return None
+
+# Added before CORS so that CORS wraps it and 413 responses still carry the CORS headers
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -42,19 +106,268 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# "torch" (sentence-transformers default), "onnx" or "onnx-int8" (ONNX Runtime, dynamically quantized weights)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+VECTOR_INDEX_DIR = Path(os.getenv("VECTOR_INDEX_DIR", "vector_index"))
+EMBEDDING_CACHE_DIR = Path(os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"))
+CHUNK_STORE_DIR = Path(os.getenv("CHUNK_STORE_DIR", "chunk_store"))
+# Garbage in the chunk data file (replaced and deleted chunks) is reclaimed once it exceeds both the live
+# data and this many bytes
+CHUNK_STORE_COMPACT_MIN_BYTES = int(os.getenv("CHUNK_STORE_COMPACT_MIN_BYTES", str(64 * 1024 * 1024)))
+
+CPU_EXECUTOR_WORKERS = int(os.getenv("CPU_EXECUTOR_WORKERS", str(os.cpu_count() or 2)))
+CPU_EXECUTOR_QUEUE = int(os.getenv("CPU_EXECUTOR_QUEUE", str(4 * CPU_EXECUTOR_WORKERS)))
+IO_EXECUTOR_WORKERS = int(os.getenv("IO_EXECUTOR_WORKERS", "32"))
+IO_EXECUTOR_QUEUE = int(os.getenv("IO_EXECUTOR_QUEUE", "256"))
+PDF_EXTRACTION_PROCESSES = int(os.getenv("PDF_EXTRACTION_PROCESSES", str(min(os.cpu_count() or 1, 8))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+# Whole-request cap for /upload-pdfs; each file in it is still held to MAX_UPLOAD_BYTES
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(20 * MAX_UPLOAD_BYTES)))
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # boundaries and part headers around a single file
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR", "uploads"))
+# Firestore: chunks live in pdf_documents/{filename}/chunks, read and deleted in pages of this size
+FIRESTORE_PAGE_SIZE = int(os.getenv("FIRESTORE_PAGE_SIZE", "500"))
+FIRESTORE_READ_CONCURRENCY = int(os.getenv("FIRESTORE_READ_CONCURRENCY", "8"))
+FIRESTORE_WRITE_RETRIES = int(os.getenv("FIRESTORE_WRITE_RETRIES", "15"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Cosine similarity above which a differently worded query reuses a cached answer (0, the default, disables;
+# near-duplicates can differ in a name or date that changes the answer, so opt in deliberately, e.g. 0.95)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+# Index type: "flat" (exact), "hnsw" (graph, lowest latency), "ivfpq" (compressed, large corpora) or "auto"
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "auto")
+AUTO_HNSW_MIN_CHUNKS = int(os.getenv("AUTO_HNSW_MIN_CHUNKS", "20000"))
+AUTO_IVFPQ_MIN_CHUNKS = int(os.getenv("AUTO_IVFPQ_MIN_CHUNKS", "200000"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+# HNSW graphs cannot drop vectors: removed ones are tombstoned and filtered at search time, and the graph is
+# rebuilt from the live vectors once this fraction of it is dead
+HNSW_COMPACT_FRACTION = float(os.getenv("HNSW_COMPACT_FRACTION", "0.25"))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 picks 4 * sqrt(chunk count)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("PQ_M", "48"))  # sub-quantizers; must divide the embedding dimension (384)
+CHAT_RETRIEVAL_K = int(os.getenv("CHAT_RETRIEVAL_K", "5"))
+# Chat retrieval fuses BM25 keyword hits with vector hits unless set to "vector"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))  # each ranker contributes k * this many candidates
+RRF_K = int(os.getenv("RRF_K", "60"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Persisting folds the keyword index's overlay and tombstones into a new segment once they exceed this many
+# chunks, or this fraction of the index, whichever is larger
+BM25_OVERLAY_MIN_CHUNKS = int(os.getenv("BM25_OVERLAY_MIN_CHUNKS", "1000"))
+BM25_OVERLAY_FRACTION = float(os.getenv("BM25_OVERLAY_FRACTION", "0.1"))
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "1000"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))  # Gemini calls in flight per batch
+# Workers sharing VECTOR_INDEX_DIR check the published version this often (seconds, 0 disables) and
+# memory-map published indexes read-only, so every worker shares one copy through the OS page cache
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "2"))
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() == "true"
+# Incremental updates are swapped in at once but written to disk at most this often (seconds, 0 writes every
+# update). Until the write lands this worker keeps the publish lock, so other workers' writes wait for it.
+INDEX_PERSIST_INTERVAL = float(os.getenv("INDEX_PERSIST_INTERVAL", "5"))
+# Gemini calls: per-attempt timeout, retries with jittered exponential backoff and optional hedging.
+# generate_answer/stream_answer are the only retry layer: at most LLM_MAX_RETRIES + 1 attempts (twice that
+# with hedging), each bounded by LLM_TIMEOUT, with the backoff sleeps between attempts outside the timeout.
+# The client libraries' own retries are turned off in get_gemini_llm so they do not multiply these.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Seconds before a backup request is sent for a slow answer (around the LLM p95); 0 disables hedging
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))
+# Background ingestion (/upload-pdfs): files extracted concurrently, files per indexing batch, jobs kept for /jobs
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(CPU_EXECUTOR_WORKERS, 4))))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+INGEST_INDEX_BATCH = int(os.getenv("INGEST_INDEX_BATCH", "16"))
+INGEST_JOB_RETENTION = int(os.getenv("INGEST_JOB_RETENTION", "10000"))
+# Add a Server-Timing header with the per-stage spans of each request
+SERVER_TIMING_HEADERS = os.getenv("SERVER_TIMING_HEADERS", "false").lower() == "true"
+# Source-scoped queries brute-force the source's own vectors up to this many, else filter the ANN search
+SCOPED_SEARCH_EXACT_LIMIT = int(os.getenv("SCOPED_SEARCH_EXACT_LIMIT", "50000"))
+# /documents: page size limits and how long this worker serves its cached manifest list (other workers'
+# uploads show up within the TTL, this worker's own immediately)
+DOCUMENTS_PAGE_SIZE = int(os.getenv("DOCUMENTS_PAGE_SIZE", "1000"))
+DOCUMENTS_MAX_PAGE_SIZE = int(os.getenv("DOCUMENTS_MAX_PAGE_SIZE", "5000"))
+DOCUMENTS_CACHE_TTL = float(os.getenv("DOCUMENTS_CACHE_TTL", "30"))
+
 # Global variables
 db = None
 vector_store = None
-document_cache = {}
+vector_store_version = None
+vector_store_fingerprint = 0
+vector_store_lock = threading.RLock()
+vector_store_build = None
+vector_store_mapped = False  # the live index is a read-only mmap of a published version
+index_lock_file = None
+index_lock_depth = 0
+pending_persist = None  # (store, version, keywords) swapped in but not yet written to VECTOR_INDEX_DIR
+persist_timer = None
+index_watch_task = None
+keyword_index = None
+source_labels_cache = (None, {})
+tombstone_selector_cache = (None, None)
+storage_generation = 0
+# Generation of each file's last store or delete; the None key marks a delete of every document
+storage_changes = {}
+
+# Process-wide thread pools with admission control
+class BoundedExecutor:
+    """Thread pool that rejects work once too many tasks are queued or running"""
+
+    def __init__(self, name: str, max_workers: int, max_pending: int, processes: bool = False):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.processes = processes
+        self.lock = threading.Lock()
+        if processes:
+            # spawn, not fork: the parent holds FAISS, gRPC and pool threads that do not survive a fork
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix=f"{name}-worker"
+            )
+
+    def _release(self, _future):
+        with self.lock:
+            self.pending -= 1
+
+    async def run(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                logger.warning(f"{self.name} executor queue is full ({self.pending} pending), rejecting work")
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"Server is busy ({self.name} queue full). Please retry shortly.",
+                    headers={"Retry-After": "1"}
+                )
+            self.pending += 1
+
+        # Release the slot when the work finishes, even if the awaiting request is cancelled.
+        # Threads run in a copy of the caller's context so stage timings land on the right request.
+        if self.processes:
+            future = self.executor.submit(fn, *args)
+        else:
+            future = self.executor.submit(contextvars.copy_context().run, fn, *args)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# "cpu": PDF extraction, embedding and index builds. "io": Firestore, Gemini and query-time retrieval,
+# so a burst of uploads saturating the cpu pool cannot starve chat traffic. "process": page-range
+# extraction of large PDFs, which is pure Python/MuPDF work that threads cannot parallelize.
+executors = {}
+
+def get_executor(kind: str) -> BoundedExecutor:
+    if kind not in executors:
+        if kind == "cpu":
+            executors[kind] = BoundedExecutor("cpu", CPU_EXECUTOR_WORKERS, CPU_EXECUTOR_QUEUE)
+        elif kind == "io":
+            executors[kind] = BoundedExecutor("io", IO_EXECUTOR_WORKERS, IO_EXECUTOR_QUEUE)
+        elif kind == "process":
+            executors[kind] = BoundedExecutor(
+                "process", PDF_EXTRACTION_PROCESSES, 4 * PDF_EXTRACTION_PROCESSES, processes=True
+            )
+        else:
+            raise ValueError(f"Unknown executor kind: {kind}")
+    return executors[kind]
+
+async def run_blocking(kind: str, fn, *args):
+    return await get_executor(kind).run(fn, *args)
+
+# Metrics: latency histograms per stage and per route, rendered in Prometheus text format on /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per tuple of label values"""
+
+    def __init__(self, name: str, description: str, label_names: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.series.items()):
+                label_text = _metric_labels(dict(zip(self.label_names, labels)))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+                lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+def _metric_labels(labels: dict) -> str:
+    parts = []
+    for name, value in labels.items():
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{escaped}"')
+    return ",".join(parts)
+
+stage_seconds = Histogram(
+    "geminy_stage_duration_seconds", "Time spent in each stage of upload and chat handling", ("stage",)
+)
+request_seconds = Histogram(
+    "geminy_request_duration_seconds", "Time to response headers per route", ("method", "route", "status")
+)
+# Stage durations of the current request, for the Server-Timing header
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def observe_stage(stage: str, seconds: float):
+    stage_seconds.observe((stage,), seconds)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
 
 # Initialize Firebase
 def initialize_firebase():
     global db
+    import firebase_admin
+    from firebase_admin import credentials, firestore
     try:
         if not firebase_admin._apps:
             cred_path = os.getenv("FIREBASE_CRED_PATH", "firebase-credentials.json")
             if not os.path.exists(cred_path):
-                logger.warning(f"Firebase credentials file not found at {cred_path}. Using mock storage.")
+                logger.warning(f"Firebase credentials file not found at {cred_path}. Using local storage.")
                 return None
                 
             cred = credentials.Certificate(cred_path)
@@ -68,18 +381,199 @@ def initialize_firebase():
         logger.error(f"Firebase initialization failed: {str(e)}")
         return None
 
-# Initialize Firebase on startup
-db = initialize_firebase()
+# On-disk embedding cache: a float32 matrix plus one content hash per row. Workers sharing the directory
+# append under a file lock, and row numbers always come from the files, never from a process's own count.
+class EmbeddingCache:
+    def __init__(self, directory: Path, namespace: str):
+        self.directory = directory / re.sub(r'[^\w.-]', '_', namespace)
+        self.vectors_path = self.directory / "vectors.f32"
+        self.keys_path = self.directory / "keys.txt"
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.row_count = 0
+        self.keys_offset = 0  # bytes of keys.txt already read into self.rows
+        self.dimension = None
+        self._vectors = None
+        self._load()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        if fcntl is None:
+            yield
+            return
+        with open(self.directory / ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _row_bytes(self) -> int:
+        return 4 * self.dimension
+
+    def _refresh(self):
+        """With the file lock held: pick up rows other workers appended since we last looked"""
+        if self.dimension is None:
+            meta_path = self.directory / "meta.json"
+            if not meta_path.exists():
+                return
+            self.dimension = json.loads(meta_path.read_text())['dimension']
+        if not self.keys_path.exists():
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self.keys_offset)
+            appended = f.read()
+        # Appends are whole lines under the lock, so a partial line can only be a torn tail
+        appended = appended[:appended.rfind(b"\n") + 1]
+        for key in appended.decode().split():
+            self.rows.setdefault(key, self.row_count)
+            self.row_count += 1
+        self.keys_offset += len(appended)
+
+    def _load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._file_lock(exclusive=True):
+            if not (self.directory / "meta.json").exists() or not self.keys_path.exists() or not self.vectors_path.exists():
+                return
+            self._refresh()
+            self._repair()
+        logger.info(f"Embedding cache loaded with {self.row_count} vectors")
+
+    def _repair(self):
+        """With the exclusive lock held: drop a torn tail left by an interrupted append, so keys and rows align"""
+        vector_rows = self.vectors_path.stat().st_size // self._row_bytes() if self.vectors_path.exists() else 0
+        if vector_rows < self.row_count:
+            keys = self.keys_path.read_text().split()[:vector_rows]
+            self.keys_path.write_text("".join(f"{key}\n" for key in keys))
+            self.rows, self.row_count, self.keys_offset = {}, 0, 0
+            self._vectors = None
+            self._refresh()
+        if self.vectors_path.exists() and self.vectors_path.stat().st_size != self.row_count * self._row_bytes():
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(self.row_count * self._row_bytes())
+
+    def _matrix(self):
+        if self._vectors is None or len(self._vectors) < self.row_count:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self.row_count, self.dimension))
+        return self._vectors
+
+    def get_many(self, keys: List[str]) -> dict:
+        with self.lock:
+            if self.keys_path.exists() and self.keys_path.stat().st_size > self.keys_offset:
+                with self._file_lock(exclusive=False):
+                    self._refresh()
+            hits = [(key, self.rows[key]) for key in keys if key in self.rows]
+            if not hits:
+                return {}
+            matrix = self._matrix()
+            return {key: np.array(matrix[row]) for key, row in hits}
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        with self.lock, self._file_lock(exclusive=True):
+            self._refresh()
+            new_items = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self.rows:
+                    new_items.setdefault(key, vector)
+            if not new_items:
+                return
+            matrix = np.asarray(list(new_items.values()), dtype=np.float32)
+            if self.dimension is None:
+                self.dimension = matrix.shape[1]
+                (self.directory / "meta.json").write_text(json.dumps({'dimension': self.dimension}))
+            self._repair()
+
+            # Vectors first: keys are what makes a row visible, to this and every other worker
+            with open(self.vectors_path, "ab") as f:
+                f.write(matrix.tobytes())
+            with open(self.keys_path, "a") as f:
+                f.write("".join(f"{key}\n" for key in new_items))
+            self._refresh()
+
+    def __len__(self):
+        return self.row_count
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only runs the model for chunk texts it has not seen before"""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put_many(list(missing.keys()), computed)
+            vectors.update(zip(missing.keys(), computed))
+            logger.info(f"Embedded {len(missing)} new chunks, {len(texts) - len(missing)} served from cache")
+
+        return [np.asarray(vectors[key], dtype=np.float32).tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed many queries in one model call; queries bypass the chunk cache"""
+        return self.embeddings.embed_documents(texts)
+
+# Embedding backends: same MiniLM weights, served by PyTorch or ONNX Runtime
+ONNX_MODEL_FILES = {
+    "onnx": "onnx/model.onnx",
+    "onnx-int8": "onnx/model_quint8_avx2.onnx"
+}
+
+def embedding_model_id(backend: str = EMBEDDING_BACKEND) -> str:
+    """Identifies the vectors a backend produces; quantized models must not share caches or indexes with fp32"""
+    if backend == "torch":
+        return EMBEDDING_MODEL_NAME
+    return f"{EMBEDDING_MODEL_NAME}:{backend}:{EMBEDDING_ONNX_FILE or ONNX_MODEL_FILES[backend]}"
+
+def create_embedding_backend(backend: str = EMBEDDING_BACKEND, batch_size: int = EMBEDDING_BATCH_SIZE,
+                             threads: int = EMBEDDING_THREADS) -> "HuggingFaceEmbeddings":
+    from langchain_huggingface import HuggingFaceEmbeddings
+    model_kwargs = {'device': 'cpu'}
+    if backend == "torch":
+        if threads > 0:
+            import torch
+            torch.set_num_threads(threads)
+    elif backend in ONNX_MODEL_FILES:
+        onnx_kwargs = {
+            'file_name': EMBEDDING_ONNX_FILE or ONNX_MODEL_FILES[backend],
+            'provider': 'CPUExecutionProvider'
+        }
+        if threads > 0:
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = threads
+            onnx_kwargs['session_options'] = session_options
+        model_kwargs.update({'backend': 'onnx', 'model_kwargs': onnx_kwargs})
+    else:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs=model_kwargs,
+        encode_kwargs={'normalize_embeddings': True, 'batch_size': batch_size}
+    )
 
 # Cache embedding model
 @lru_cache(maxsize=1)
 def get_embedding_model():
     try:
-        return HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        embeddings = create_embedding_backend()
+        logger.info(f"Embedding model loaded: {embedding_model_id()} (batch size {EMBEDDING_BATCH_SIZE})")
+        return CachedEmbeddings(embeddings, EmbeddingCache(EMBEDDING_CACHE_DIR, embedding_model_id()))
     except Exception as e:
         logger.error(f"Error loading embedding model: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to load embedding model")
@@ -87,6 +581,7 @@ def get_embedding_model():
 # Cache text splitter with better parameters
 @lru_cache(maxsize=1)
 def get_text_splitter():
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
     return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,  # Increased overlap for better context
@@ -97,23 +592,34 @@ def get_text_splitter():
 # Cache LLM with better configuration
 @lru_cache(maxsize=1)
 def get_gemini_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI, chat_models as gemini_chat_models
     try:
         gemini_api_key = os.getenv("GEMINI_API_KEY")
         if not gemini_api_key:
             raise ValueError("Missing Gemini API Key. Please set GEMINI_API_KEY in environment variables.")
-        
-        return ChatGoogleGenerativeAI(
+
+        # langchain-google-genai wraps each call in a tenacity retry (2 attempts, no jitter, any GoogleAPIError)
+        # that cannot be configured, so it is replaced with a no-op decorator
+        if hasattr(gemini_chat_models, "_create_retry_decorator"):
+            gemini_chat_models._create_retry_decorator = lambda: (lambda method: method)
+
+        llm = ChatGoogleGenerativeAI(
             google_api_key=gemini_api_key,
             model="gemini-2.5-flash", 
             temperature=0.3,
             max_tokens=2048,
+            timeout=LLM_TIMEOUT,
             convert_system_message_to_human=True
         )
+        # Passed through to the gRPC call: no google-api-core retry on ServiceUnavailable (600s deadline
+        # by default), and a server-side deadline matching the per-attempt timeout
+        return llm.bind(retry=None, timeout=LLM_TIMEOUT)
     except Exception as e:
         logger.error(f"Error initializing Gemini LLM: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to initialize LLM")
 
 # Custom prompt template for better responses
+@lru_cache(maxsize=1)
 def get_qa_prompt():
     template = """You are a friendly and helpful AI assistant that answers questions based on the provided document context.
 
@@ -134,8 +640,120 @@ Answer:"""
         input_variables=["context", "question"]
     )
 
-# Dependency to get required components
-def get_components():
+# Prompt -> Gemini -> text, built once and shared by every request
+@lru_cache(maxsize=1)
+def get_answer_chain():
+    from langchain_core.output_parsers import StrOutputParser
+    return get_qa_prompt() | get_gemini_llm() | StrOutputParser()
+
+def _answer_inputs(question: str, documents: List[Document]) -> dict:
+    # Retrieved chunks joined by blank lines make up the prompt context
+    return {"context": "\n\n".join(doc.page_content for doc in documents), "question": question}
+
+llm_stats = {"retries": 0, "hedged": 0, "timeouts": 0}
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    try:
+        from google.api_core import exceptions as google_exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded
+    ))
+
+def _backoff_delay(attempt: int) -> float:
+    # Full jitter, so requests that failed together do not retry together
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+async def _invoke_with_timeout(inputs: dict) -> str:
+    try:
+        return await asyncio.wait_for(get_answer_chain().ainvoke(inputs), LLM_TIMEOUT)
+    except asyncio.TimeoutError:
+        llm_stats["timeouts"] += 1
+        raise
+
+async def _invoke_hedged(inputs: dict) -> str:
+    """One attempt: the primary call plus, if it is still running after LLM_HEDGE_DELAY, a backup call;
+    the first to succeed wins and the other is cancelled"""
+    tasks = [asyncio.create_task(_invoke_with_timeout(inputs))]
+    try:
+        if LLM_HEDGE_DELAY > 0:
+            done, _ = await asyncio.wait(tasks, timeout=LLM_HEDGE_DELAY)
+            if not done:
+                llm_stats["hedged"] += 1
+                tasks.append(asyncio.create_task(_invoke_with_timeout(inputs)))
+
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def generate_answer(question: str, documents: List[Document]) -> str:
+    """Answer from the retrieved chunks through Gemini's async API, retrying transient failures"""
+    inputs = _answer_inputs(question, documents)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            return await _invoke_hedged(inputs)
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = _backoff_delay(attempt)
+            llm_stats["retries"] += 1
+            logger.warning(f"Gemini call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+async def stream_answer(question: str, documents: List[Document]):
+    """Yield answer text as Gemini produces it. Failures before the first token are retried like
+    generate_answer; once text has been sent the stream can only fail. Every chunk has LLM_TIMEOUT."""
+    inputs = _answer_inputs(question, documents)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        stream = get_answer_chain().astream(inputs)
+        try:
+            try:
+                first = await asyncio.wait_for(stream.__anext__(), LLM_TIMEOUT)
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    llm_stats["timeouts"] += 1
+                if attempt == LLM_MAX_RETRIES or not _is_retryable(e):
+                    raise
+                delay = _backoff_delay(attempt)
+                llm_stats["retries"] += 1
+                logger.warning(f"Gemini stream failed before the first token ({type(e).__name__}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            yield first
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), LLM_TIMEOUT)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    llm_stats["timeouts"] += 1
+                    raise
+                yield chunk
+        finally:
+            await stream.aclose()
+
+# Dependency to get required components; waits for the startup warmup so early requests see Firebase
+async def get_components():
+    await wait_until_warm()
     try:
         return {
             "embedding_fn": get_embedding_model(),
@@ -146,62 +764,498 @@ def get_components():
         raise HTTPException(status_code=500, detail="Failed to initialize components")
 
 # Enhanced PDF text extraction with better error handling
-async def extract_text_from_pdf(file_path: str) -> str:
+async def extract_text_from_pdf(file_path: str) -> dict:
+    """Extract text plus page boundaries, splitting large PDFs into page ranges across processes"""
     try:
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            text = await loop.run_in_executor(pool, _extract_text_from_pdf, file_path)
-        
-        if not text or len(text.strip()) < 10:
+        page_count = await run_blocking("cpu", _count_pdf_pages, file_path)
+
+        workers = get_executor("process").max_workers
+        if page_count >= PDF_PARALLEL_MIN_PAGES and workers > 1:
+            step = -(-page_count // workers)
+            ranges = await asyncio.gather(*[
+                run_blocking("process", _extract_page_range, file_path, start, min(start + step, page_count))
+                for start in range(0, page_count, step)
+            ])
+            pages = [page for page_range in ranges for page in page_range]
+        else:
+            pages = await run_blocking("cpu", _extract_page_range, file_path, 0, page_count)
+
+        extracted = _assemble_pdf_text(pages)
+        extracted['page_count'] = page_count
+        if len(extracted['text']) < 10:
             raise ValueError("PDF appears to be empty or contains no extractable text")
         
-        return text
+        return extracted
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error extracting text from PDF: {str(e)}")
         raise ValueError(f"Error extracting text from PDF: {str(e)}")
 
-def _extract_text_from_pdf(file_path: str) -> str:
-    text = ""
+def _count_pdf_pages(file_path: str) -> int:
+    import fitz
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> List[tuple]:
+    """Extract (page_number, text) for pages [start, stop); runs in a worker process for large PDFs"""
+    import fitz
+    pages = []
     try:
         with fitz.open(file_path) as doc:
-            for page_num, page in enumerate(doc):
+            for page_num in range(start, stop):
                 try:
-                    page_text = page.get_text("text")
+                    page_text = doc[page_num].get_text("text")
                     if page_text.strip():
-                        text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
+                        pages.append((page_num + 1, page_text))
                 except Exception as e:
                     logger.warning(f"Error extracting text from page {page_num + 1}: {str(e)}")
                     continue
         
-        return text.strip()
+        return pages
     except Exception as e:
         logger.error(f"Error opening PDF file: {str(e)}")
         raise
 
-# Mock storage for when Firebase is not available
-class MockStorage:
-    def __init__(self):
-        self.documents = {}
-    
-    def store_document(self, filename: str, text: str, chunks: List[str]):
-        doc_id = hashlib.md5(filename.encode()).hexdigest()
-        self.documents[doc_id] = {
-            'filename': filename,
-            'text': text,
-            'chunks': chunks,
-            'timestamp': time.time()
-        }
-        logger.info(f"Document stored in mock storage: {filename}")
-    
-    def get_all_documents(self):
-        return list(self.documents.values())
-    
+def _assemble_pdf_text(pages: List[tuple]) -> dict:
+    # Join once instead of repeated string concatenation, recording where each page lands in the text
+    parts = []
+    spans = []
+    offset = 0
+    for page_number, page_text in pages:
+        part = f"\n--- Page {page_number} ---\n{page_text}\n"
+        parts.append(part)
+        spans.append({'page': page_number, 'start': offset, 'end': offset + len(part)})
+        offset += len(part)
+
+    text = "".join(parts)
+    stripped = text.strip()
+    leading = len(text) - len(text.lstrip())
+    for span in spans:
+        span['start'] = max(span['start'] - leading, 0)
+        span['end'] = min(span['end'] - leading, len(stripped))
+
+    return {'text': stripped, 'pages': spans}
+
+def _chunk_pages(text: str, chunks: List[str], spans: List[dict]) -> List[List[int]]:
+    """Pages each chunk overlaps, found by locating the chunks in order in the assembled text"""
+    starts = [span['start'] for span in spans]
+    chunk_pages = []
+    cursor = 0
+    for chunk in chunks:
+        start = text.find(chunk, cursor)
+        if start == -1:
+            start = text.find(chunk)
+        if start == -1:
+            chunk_pages.append([])
+            continue
+        # Chunks overlap, so the next one starts after this one's start rather than its end
+        cursor = start + 1
+        end = start + len(chunk)
+        first = max(bisect.bisect_right(starts, start) - 1, 0)
+        chunk_pages.append([span['page'] for span in spans[first:] if span['start'] < end])
+    return chunk_pages
+
+def _format_pages(pages: List[int]) -> str:
+    return ",".join(str(page) for page in pages)
+
+def _parse_pages(value: Optional[str]) -> List[int]:
+    return [int(page) for page in value.split(",")] if value else []
+
+# Local chunk store, used when Firebase is not available and as the text behind the FAISS docstore.
+# Chunk text is appended to one data file and memory-mapped for reads; SQLite holds the offsets and
+# per-document metadata, so nothing keeps the corpus in Python memory and every worker shares the files.
+class ChunkStore:
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.mapped = (None, None)  # (generation, mmap) of the data file being read
+
+    def _connect(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            import sqlite3
+            self.directory.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.directory / "chunks.db", timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    filename TEXT PRIMARY KEY, content_hash TEXT, chunk_count INTEGER,
+                    text_length INTEGER, timestamp REAL, page_count INTEGER);
+                CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash);
+                CREATE TABLE IF NOT EXISTS chunks (
+                    filename TEXT, chunk_id INTEGER, offset INTEGER, length INTEGER, fingerprint INTEGER,
+                    pages TEXT, PRIMARY KEY (filename, chunk_id));
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+                INSERT OR IGNORE INTO meta VALUES ('generation', 0), ('dead_bytes', 0);
+            """)
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(documents)")}
+            if "page_count" not in columns:
+                connection.execute("ALTER TABLE documents ADD COLUMN page_count INTEGER")
+            if "pages" not in {row[1] for row in connection.execute("PRAGMA table_info(chunks)")}:
+                connection.execute("ALTER TABLE chunks ADD COLUMN pages TEXT")
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def _write(self):
+        """One writer at a time across threads and processes: SQLite's write lock guards the data file too"""
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _fingerprint(filename: str, chunk_id: int, text: str) -> int:
+        # SQLite integers are signed 64-bit
+        fingerprint = _chunk_fingerprint(f"{filename}#{chunk_id}", text)
+        return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+    def _meta(self, connection, key: str) -> int:
+        return connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def _data_path(self, generation: int) -> Path:
+        return self.directory / f"chunks-{generation}.dat"
+
+    def _append(self, connection, rows: List[tuple]) -> List[tuple]:
+        """Append (filename, chunk_id, text, pages) rows to the data file; returns their chunk table rows"""
+        payloads = [text.encode() for _, _, text, _ in rows]
+        with open(self._data_path(self._meta(connection, "generation")), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(b"".join(payloads))
+            f.flush()
+            os.fsync(f.fileno())
+        records = []
+        for (filename, chunk_id, text, pages), payload in zip(rows, payloads):
+            records.append((filename, chunk_id, offset, len(payload), self._fingerprint(filename, chunk_id, text),
+                            _format_pages(pages)))
+            offset += len(payload)
+        return records
+
+    def _delete_chunks(self, connection, where: str, args: tuple):
+        dead = connection.execute(f"SELECT COALESCE(SUM(length), 0) FROM chunks WHERE {where}", args).fetchone()[0]
+        connection.execute(f"DELETE FROM chunks WHERE {where}", args)
+        connection.execute("UPDATE meta SET value = value + ? WHERE key = 'dead_bytes'", (dead,))
+
+    def _maybe_compact(self, connection):
+        """Rewrite the live chunks into a new data file once more than half of the current one is garbage"""
+        dead = self._meta(connection, "dead_bytes")
+        live = connection.execute("SELECT COALESCE(SUM(length), 0) FROM chunks").fetchone()[0]
+        if dead < max(live, CHUNK_STORE_COMPACT_MIN_BYTES):
+            return
+        generation = self._meta(connection, "generation")
+        rows = connection.execute("SELECT filename, chunk_id, offset, length FROM chunks ORDER BY offset").fetchall()
+        records = []
+        with open(self._data_path(generation), "rb") as source, open(self._data_path(generation + 1), "wb") as target:
+            for filename, chunk_id, offset, length in rows:
+                source.seek(offset)
+                records.append((target.tell(), filename, chunk_id))
+                target.write(source.read(length))
+            target.flush()
+            os.fsync(target.fileno())
+        connection.executemany("UPDATE chunks SET offset = ? WHERE filename = ? AND chunk_id = ?", records)
+        connection.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (generation + 1,))
+        connection.execute("UPDATE meta SET value = 0 WHERE key = 'dead_bytes'")
+        # Readers that mapped the old file keep their mapping until they notice the new generation
+        self._data_path(generation).unlink(missing_ok=True)
+        logger.info(f"Compacted chunk store: {dead} bytes reclaimed")
+
+    def _view(self, generation: int, needed: int):
+        """mmap of the data file for this generation, remapped when it has grown past what was mapped"""
+        import mmap
+        with self.lock:
+            mapped_generation, view = self.mapped
+            if mapped_generation != generation or view is None or len(view) < needed:
+                # The mapping outlives the file object; an old one is freed once no reader holds it
+                with open(self._data_path(generation), "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+                self.mapped = (generation, view)
+            return view
+
+    def read_chunks(self, keys: List[tuple]) -> dict:
+        """Materialize the text of (filename, chunk_id) pairs; missing chunks are left out"""
+        return {key: text for key, (text, _) in self.read_chunk_records(keys).items()}
+
+    def read_chunk_records(self, keys: List[tuple]) -> dict:
+        """(text, pages) of (filename, chunk_id) pairs; missing chunks are left out"""
+        by_file = {}
+        for filename, chunk_id in keys:
+            by_file.setdefault(filename, []).append(chunk_id)
+        connection = self._connect()
+        for attempt in range(3):
+            rows = []
+            # One read transaction, so the offsets and the generation they refer to agree
+            connection.execute("BEGIN")
+            try:
+                generation = self._meta(connection, "generation")
+                for filename, chunk_ids in by_file.items():
+                    for start in range(0, len(chunk_ids), 500):
+                        batch = chunk_ids[start:start + 500]
+                        rows += connection.execute(
+                            f"SELECT filename, chunk_id, offset, length, pages FROM chunks WHERE filename = ? "
+                            f"AND chunk_id IN ({','.join('?' * len(batch))})", (filename, *batch)
+                        ).fetchall()
+            finally:
+                connection.execute("COMMIT")
+            if not rows:
+                return {}
+            try:
+                view = self._view(generation, max(offset + length for _, _, offset, length, _ in rows))
+            except FileNotFoundError:
+                continue  # compacted by another writer since our read transaction; read the new offsets
+            return {
+                (filename, chunk_id): (view[offset:offset + length].decode(), _parse_pages(pages))
+                for filename, chunk_id, offset, length, pages in rows
+            }
+        raise RuntimeError("Chunk store kept changing while reading")
+
+    def put_chunks(self, documents: List[Document]):
+        """Write chunk text for the docstore, skipping chunks already stored with the same content"""
+        with self._write() as connection:
+            stored = {}
+            pages = {}
+            for document in documents:
+                key = (document.metadata['source'], document.metadata['chunk_id'])
+                stored[key] = document.page_content
+                pages[key] = document.metadata.get('pages', [])
+            fingerprints = {}
+            for filename in {filename for filename, _ in stored}:
+                fingerprints.update(
+                    ((filename, chunk_id), fingerprint) for chunk_id, fingerprint in connection.execute(
+                        "SELECT chunk_id, fingerprint FROM chunks WHERE filename = ?", (filename,)
+                    )
+                )
+            changed = [
+                (filename, chunk_id, text, pages[(filename, chunk_id)]) for (filename, chunk_id), text in stored.items()
+                if fingerprints.get((filename, chunk_id)) != self._fingerprint(filename, chunk_id, text)
+            ]
+            if not changed:
+                return
+            for filename, chunk_id, _, _ in changed:
+                if (filename, chunk_id) in fingerprints:
+                    self._delete_chunks(connection, "filename = ? AND chunk_id = ?", (filename, chunk_id))
+            connection.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)", self._append(connection, changed))
+
+    def forget_chunks(self, keys: List[tuple]):
+        """Drop chunk text the index no longer needs, unless it belongs to a locally stored document"""
+        with self._write() as connection:
+            local = {row[0] for row in connection.execute("SELECT filename FROM documents")}
+            for filename, chunk_id in keys:
+                if filename not in local:
+                    self._delete_chunks(connection, "filename = ? AND chunk_id = ?", (filename, chunk_id))
+            self._maybe_compact(connection)
+
+    def store_document(self, filename: str, text: str, chunks: List[str], content_hash: str = None,
+                       page_count: Optional[int] = None, chunk_pages: Optional[List[List[int]]] = None):
+        chunk_pages = chunk_pages or [[] for _ in chunks]
+        with self._write() as connection:
+            self._delete_chunks(connection, "filename = ?", (filename,))
+            rows = [(filename, i, chunk, pages) for i, (chunk, pages) in enumerate(zip(chunks, chunk_pages))]
+            connection.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)", self._append(connection, rows))
+            connection.execute(
+                "INSERT OR REPLACE INTO documents (filename, content_hash, chunk_count, text_length, timestamp, "
+                "page_count) VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, content_hash, len(chunks), len(text), time.time(), page_count)
+            )
+            self._maybe_compact(connection)
+        logger.info(f"Document stored in local chunk store: {filename}")
+
+    def find_by_hash(self, content_hash: str):
+        row = self._connect().execute(
+            "SELECT filename, chunk_count, text_length FROM documents WHERE content_hash = ? LIMIT 1", (content_hash,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'filename': row[0], 'chunk_count': row[1], 'text_length': row[2]}
+
+    def get_all_documents(self) -> List[dict]:
+        """Manifest of every locally stored document, without its text"""
+        rows = self._connect().execute(
+            "SELECT filename, content_hash, chunk_count, text_length, page_count, timestamp FROM documents"
+        ).fetchall()
+        return [
+            {'filename': row[0], 'content_hash': row[1], 'chunk_count': row[2], 'text_length': row[3],
+             'page_count': row[4], 'ingested_at': row[5]}
+            for row in rows
+        ]
+
+    def read_document_chunks(self, filename: str, chunk_count: int) -> tuple:
+        """The document's chunk texts and the pages of each chunk"""
+        records = self.read_chunk_records([(filename, i) for i in range(chunk_count)])
+        chunks = [records.get((filename, i), ("", []))[0] for i in range(chunk_count)]
+        return chunks, [records.get((filename, i), ("", []))[1] for i in range(chunk_count)]
+
+    def delete_document(self, filename: str) -> bool:
+        with self._write() as connection:
+            deleted = connection.execute("DELETE FROM documents WHERE filename = ?", (filename,)).rowcount > 0
+            self._delete_chunks(connection, "filename = ?", (filename,))
+            self._maybe_compact(connection)
+        return deleted
+
     def delete_all(self):
-        self.documents.clear()
-        logger.info("All documents deleted from mock storage")
+        with self._write() as connection:
+            generation = self._meta(connection, "generation")
+            connection.execute("DELETE FROM documents")
+            connection.execute("DELETE FROM chunks")
+            connection.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (generation + 1,))
+            connection.execute("UPDATE meta SET value = 0 WHERE key = 'dead_bytes'")
+            self._data_path(generation).unlink(missing_ok=True)
+        logger.info("All documents deleted from local chunk store")
+
+    def size_bytes(self) -> int:
+        return sum(path.stat().st_size for path in self.directory.glob("chunks*")) if self.directory.exists() else 0
+
+chunk_store = ChunkStore(CHUNK_STORE_DIR)
+
+class ChunkDocstore(Docstore, AddableMixin):
+    """FAISS docstore that keeps only per-chunk fingerprints in memory and reads text from the chunk store
+    when a chunk is actually returned"""
+
+    def __init__(self, storage: Optional[dict] = None, fingerprints: Optional[dict] = None,
+                 content_hashes: Optional[dict] = None):
+        self.storage = storage or {}  # filename -> 'firebase' or 'local', for the Document metadata
+        self.fingerprints = fingerprints or {}  # doc ID -> _chunk_fingerprint, so removals need no text
+        self.content_hashes = content_hashes or {}  # filename -> content hash of the indexed version
+
+    def add(self, texts: dict):
+        chunk_store.put_chunks(list(texts.values()))
+        for doc_id, document in texts.items():
+            self.storage[document.metadata['source']] = document.metadata.get('storage', 'local')
+            self.content_hashes[document.metadata['source']] = document.metadata.get('content_hash')
+            self.fingerprints[doc_id] = _chunk_fingerprint(doc_id, document.page_content)
+
+    def delete(self, ids: List):
+        self.discard(ids)
+        chunk_store.forget_chunks([_split_document_id(doc_id) for doc_id in ids])
+
+    def discard(self, ids: List):
+        """Drop chunks from this docstore only: their text stays readable for copies still serving searches"""
+        for doc_id in ids:
+            self.fingerprints.pop(doc_id, None)
+
+    def copy(self) -> "ChunkDocstore":
+        return ChunkDocstore(dict(self.storage), dict(self.fingerprints), dict(self.content_hashes))
+
+    def to_dict(self) -> dict:
+        return {"storage": self.storage, "fingerprints": self.fingerprints, "content_hashes": self.content_hashes}
+
+    def fingerprint(self, doc_id: str) -> int:
+        return self.fingerprints.get(doc_id, 0)
+
+    def mget(self, ids: List[str]) -> List[Optional[Document]]:
+        keys = [_split_document_id(doc_id) for doc_id in ids]
+        records = chunk_store.read_chunk_records(keys)
+        return [
+            Document(page_content=records[key][0], metadata=_chunk_metadata(
+                key[0], key[1], self.storage.get(key[0], 'local'), records[key][1]
+            )) if key in records else None
+            for key in keys
+        ]
+
+    def search(self, search: str):
+        document = self.mget([search])[0]
+        return document if document is not None else f"ID {search} not found."
+
+    @classmethod
+    def from_documents(cls, documents: dict) -> "ChunkDocstore":
+        docstore = cls()
+        docstore.add(documents)
+        return docstore
+
+@app.on_event("startup")
+async def start_executors():
+    for kind in ("cpu", "io", "process"):
+        executor = get_executor(kind)
+        logger.info(f"{kind} executor started with {executor.max_workers} workers, queue limit {executor.max_pending}")
+
+@app.on_event("shutdown")
+async def stop_executors():
+    for executor in executors.values():
+        executor.shutdown()
+    executors.clear()
+
+# Warmup: Firebase, the embedding model, the persisted index and the request-path modules load in the
+# background, so the server accepts connections (and /health answers) right away; /ready waits for it
+warmup_task = None
+warmup_status = {"state": "pending", "stages": {}, "warnings": [], "error": None}
+
+async def wait_until_warm():
+    """Dependency for endpoints that touch storage or the models"""
+    if warmup_task is not None and not warmup_task.done():
+        await asyncio.shield(warmup_task)
+
+def _load_components() -> dict:
+    embedding_fn = get_embedding_model()
+    embedding_fn.embed_query("warmup")  # first call initializes the model's kernels
+    return {"embedding_fn": embedding_fn, "text_splitter": get_text_splitter()}
+
+def _preload_request_modules():
+    import fitz  # noqa: F401
+    get_answer_chain()
+
+async def _warmup_stage(name: str, awaitable):
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        warmup_status["stages"][name] = time.perf_counter() - started
+        observe_stage(f"warmup_{name}", warmup_status["stages"][name])
 
-# Initialize mock storage
-mock_storage = MockStorage()
+async def _warmup():
+    started = time.perf_counter()
+    warmup_status["state"] = "running"
+    try:
+        await _warmup_stage("firebase", run_blocking("io", initialize_firebase))
+        components = await _warmup_stage("embedding_model", run_blocking("cpu", _load_components))
+        await _warmup_stage("vector_store", _load_vector_store_on_startup(components))
+        if INDEX_MMAP and not _flat_index_mmap_supported():
+            warmup_status["warnings"].append(
+                "FAISS < 1.10: flat and HNSW indexes cannot be memory-mapped, each worker loads its own copy"
+            )
+        try:
+            await _warmup_stage("request_modules", run_blocking("io", _preload_request_modules))
+        except Exception as e:
+            # Chat will report a missing Gemini key itself; uploads and search still work
+            warmup_status["warnings"].append(f"LLM not initialized: {getattr(e, 'detail', str(e))}")
+        warmup_status["state"] = "ready"
+        logger.info(f"Warmup finished in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        warmup_status["state"] = "failed"
+        warmup_status["error"] = getattr(e, 'detail', str(e))
+        logger.error(f"Warmup failed: {warmup_status['error']}")
+
+@app.on_event("startup")
+async def start_warmup():
+    global warmup_task
+    warmup_task = asyncio.create_task(_warmup())
+
+async def _load_vector_store_on_startup(components: dict):
+    """Warm start from the persisted index, then verify it against storage in the background"""
+    global index_watch_task
+    try:
+        if INDEX_WATCH_INTERVAL > 0:
+            index_watch_task = asyncio.create_task(_watch_published_index())
+        if await run_blocking("cpu", _load_published_vector_store, components["embedding_fn"]):
+            asyncio.create_task(_verify_vector_store_version(components))
+    except Exception as e:
+        logger.warning(f"Could not load persisted vector store: {str(e)}")
+
+@app.on_event("shutdown")
+async def stop_index_watcher():
+    if index_watch_task is not None:
+        index_watch_task.cancel()
+
+@app.on_event("shutdown")
+async def flush_vector_store():
+    # The executors may already be shut down; the default thread still keeps the file lock off the event loop
+    await asyncio.to_thread(_flush_pending_persist)
 
 @app.get("/")
 async def root():
@@ -209,19 +1263,321 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    """Liveness: answers as soon as the process is up, warm or not"""
     return {
         "status": "healthy",
         "firebase_connected": db is not None,
-        "components_loaded": True
+        "components_loaded": warmup_status["state"] == "ready",
+        "answer_cache": answer_cache.stats()
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once the warmup has loaded Firebase, the embedding model and the index, 503 until then"""
+    content = {
+        "ready": warmup_status["state"] == "ready",
+        "state": warmup_status["state"],
+        "stages": warmup_status["stages"],
+        "warnings": warmup_status["warnings"],
+        "error": warmup_status["error"],
+        "firebase_connected": db is not None,
+        "vector_store_chunks": len(vector_store.index_to_docstore_id) if vector_store is not None else 0,
+        "index_memory_mapped": vector_store_mapped
     }
+    return JSONResponse(content=content, status_code=200 if content["ready"] else 503)
+
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    timings = {}
+    request_timings.set(timings)
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    # Label by route template, not raw path, so /documents/{filename} stays one series
+    route = request.scope.get("route")
+    request_seconds.observe((request.method, route.path if route else "unmatched", str(response.status_code)), elapsed)
+    if SERVER_TIMING_HEADERS:
+        spans = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+        response.headers["Server-Timing"] = ", ".join(spans + [f"total;dur={elapsed * 1000:.1f}"])
+    return response
+
+def _index_memory_bytes(index) -> int:
+    """Approximate resident size of a FAISS index without serializing it"""
+    import faiss
+    if hasattr(index, 'hnsw'):
+        return index.ntotal * index.d * 4 + index.hnsw.neighbors.size() * 4
+    if hasattr(index, 'nprobe'):
+        ivf = faiss.extract_index_ivf(index)
+        return index.ntotal * (ivf.code_size + 8) + ivf.nlist * index.d * 4
+    return index.ntotal * index.d * 4
+
+def _gauge(name: str, description: str, samples) -> List[str]:
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{{{_metric_labels(labels)}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of stage latencies plus index and cache gauges"""
+    store = vector_store
+    keywords = keyword_index
+    cache_stats = answer_cache.stats()
+    lines = stage_seconds.render() + request_seconds.render()
+    lines += _gauge("geminy_index_chunks", "Chunks in the live vector index",
+                    [({}, len(store.index_to_docstore_id) if store is not None else 0)])
+    lines += _gauge("geminy_index_memory_bytes", "Approximate memory held by the FAISS index",
+                    [({}, _index_memory_bytes(store.index) if store is not None else 0)])
+    lines += _gauge("geminy_index_memory_mapped", "1 if the live index is a read-only mmap of a published version",
+                    [({}, int(vector_store_mapped))])
+    lines += _gauge("geminy_keyword_index_chunks", "Chunks in the BM25 keyword index",
+                    [({}, len(keywords) if keywords is not None else 0)])
+    lines += _gauge("geminy_answer_cache_entries", "Cached answers", [({}, cache_stats["size"])])
+    lines += _gauge("geminy_answer_cache_hit_ratio", "Answer cache hits over lookups", [({}, cache_stats["hit_rate"])])
+    for counter in ("hits", "misses", "evictions"):
+        lines += [
+            f"# HELP geminy_answer_cache_{counter}_total Answer cache {counter}",
+            f"# TYPE geminy_answer_cache_{counter}_total counter",
+            f"geminy_answer_cache_{counter}_total {cache_stats[counter]}"
+        ]
+    for counter in ("retries", "hedged", "timeouts"):
+        lines += [
+            f"# HELP geminy_llm_{counter}_total Gemini calls {counter}",
+            f"# TYPE geminy_llm_{counter}_total counter",
+            f"geminy_llm_{counter}_total {llm_stats[counter]}"
+        ]
+    lines += _gauge("geminy_ingest_queue_depth", "Ingestion jobs waiting per pipeline queue", [
+        ({"queue": "extract"}, ingest_queue.qsize() if ingest_queue is not None else 0),
+        ({"queue": "index"}, index_queue.qsize() if index_queue is not None else 0)
+    ])
+    job_states = {}
+    for job in list(ingest_jobs.values()):
+        job_states[job["status"]] = job_states.get(job["status"], 0) + 1
+    lines += _gauge("geminy_ingest_jobs", "Ingestion jobs tracked per status",
+                    [({"status": state}, count) for state, count in sorted(job_states.items())])
+    lines += _gauge("geminy_chunk_store_bytes", "Size of the local chunk store files", [({}, chunk_store.size_bytes())])
+    lines += _gauge("geminy_executor_pending", "Tasks queued or running per executor",
+                    [({"executor": name}, executor.pending) for name, executor in executors.items()])
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+# gRPC status codes worth retrying: DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED, ABORTED, INTERNAL, UNAVAILABLE
+FIRESTORE_RETRYABLE_CODES = {4, 8, 10, 13, 14}
+
+@contextmanager
+def _checked_bulk_writer():
+    """BulkWriter that raises once closed if any write failed for good; close() itself only drops them"""
+    failures = []
+
+    def on_write_error(failure, _writer) -> bool:
+        if failure.code in FIRESTORE_RETRYABLE_CODES and failure.attempts < FIRESTORE_WRITE_RETRIES:
+            return True
+        failures.append(failure)
+        return False
+
+    writer = db.bulk_writer()
+    writer.on_write_error(on_write_error)
+    try:
+        yield writer
+    finally:
+        writer.close()
+    if failures:
+        raise RuntimeError(f"{len(failures)} Firestore writes failed: {failures[0].message}")
+
+def _next_page(query, previous: Optional[set]) -> tuple:
+    """Next page of a delete-until-empty loop; raises if the previous page's deletes made no progress"""
+    docs = list(query.limit(FIRESTORE_PAGE_SIZE).stream())
+    paths = {doc.reference.path for doc in docs}
+    if docs and paths == previous:
+        raise RuntimeError("Firestore deletes are not taking effect")
+    return docs, paths
+
+def _delete_collection(collection_ref) -> int:
+    """Delete every document in a collection, one page at a time until it is empty"""
+    deleted = 0
+    paths = None
+    while True:
+        docs, paths = _next_page(collection_ref.select([]), paths)
+        if not docs:
+            return deleted
+        with _checked_bulk_writer() as writer:
+            for doc in docs:
+                writer.delete(doc.reference)
+        deleted += len(docs)
+
+def _chunk_collection(doc_data: dict) -> str:
+    # Documents written before chunk generations keep theirs in 'chunks'
+    return doc_data.get('chunk_collection') or 'chunks'
+
+def _delete_chunk_collections(doc_ref):
+    """Every chunk generation of a document, including ones orphaned by a failed re-upload"""
+    for collection_ref in doc_ref.collections():
+        _delete_collection(collection_ref)
+
+def _store_firebase_document(filename: str, text: str, chunks: List[str], content_hash: str,
+                             page_count: Optional[int] = None, chunk_pages: Optional[List[List[int]]] = None):
+    # Chunks go into a subcollection so no single document approaches Firestore's 1 MiB limit. Each write
+    # gets a new one, named by the parent, so readers see the previous version until the parent switches.
+    doc_ref = db.collection('pdf_documents').document(filename)
+    chunk_collection = f"chunks-{uuid.uuid4().hex[:12]}"
+    chunks_ref = doc_ref.collection(chunk_collection)
+
+    from firebase_admin import firestore
+    try:
+        with _checked_bulk_writer() as writer:
+            for i, chunk in enumerate(chunks):
+                writer.set(chunks_ref.document(f"{i:06d}"), {
+                    'index': i, 'text': chunk, 'pages': chunk_pages[i] if chunk_pages else []
+                })
+
+        # Written last, so readers never see a document whose chunks are still being written. It doubles as
+        # the document's manifest: /documents reads only these fields.
+        doc_ref.set({
+            'filename': filename,
+            'content_hash': content_hash,
+            'timestamp': firestore.SERVER_TIMESTAMP,
+            'ingested_at': time.time(),
+            'chunk_count': len(chunks),
+            'text_length': len(text),
+            'page_count': page_count,
+            'sharded': True,
+            'chunk_collection': chunk_collection
+        })
+    except Exception:
+        # The caller falls back to the local store. A previous Firebase version left in place would be
+        # listed next to the local copy and shadow it in the index, so its parent goes first.
+        try:
+            doc_ref.delete()
+            _delete_chunk_collections(doc_ref)
+        except Exception as e:
+            logger.error(f"Could not remove Firebase copy of {filename} after a failed write: {str(e)}")
+        raise
+
+    # Previous generations, and any orphaned by an earlier failed write, are unreachable now
+    try:
+        for collection_ref in doc_ref.collections():
+            if collection_ref.id != chunk_collection:
+                _delete_collection(collection_ref)
+    except Exception as e:
+        logger.warning(f"Could not delete previous chunks of {filename}: {str(e)}")
+
+def _store_document(filename: str, text: str, chunks: List[str], content_hash: str,
+                    page_count: Optional[int] = None, chunk_pages: Optional[List[List[int]]] = None) -> str:
+    """Store in Firebase, falling back to the local chunk store; returns where the document ended up"""
+    if db:
+        try:
+            _store_firebase_document(filename, text, chunks, content_hash, page_count, chunk_pages)
+            logger.info(f"Document stored in Firebase: {filename} ({len(chunks)} chunks)")
+            # A local copy from an earlier fallback would now be listed twice
+            if chunk_store.delete_document(filename):
+                logger.info(f"Removed the local copy of {filename}, now stored in Firebase")
+            return 'firebase'
+        except Exception as e:
+            logger.error(f"Firebase storage failed: {str(e)}")
+
+    chunk_store.store_document(filename, text, chunks, content_hash, page_count, chunk_pages)
+    return 'local'
+
+def _find_ingested_document(content_hash: str):
+    """Return filename, chunk count and text length of an already stored PDF with this content hash"""
+    if db:
+        try:
+            docs = (
+                db.collection('pdf_documents')
+                .where('content_hash', '==', content_hash)
+                .select(['filename', 'chunk_count', 'text_length'])
+                .limit(1)
+                .stream()
+            )
+            for doc in docs:
+                doc_data = doc.to_dict()
+                return {
+                    'filename': doc_data.get('filename'),
+                    'chunk_count': doc_data.get('chunk_count', 0),
+                    'text_length': doc_data.get('text_length')
+                }
+        except Exception as e:
+            logger.warning(f"Firebase duplicate lookup failed: {str(e)}")
+
+    return chunk_store.find_by_hash(content_hash)
+
+def _note_storage_change(filename: Optional[str] = None):
+    """Bump the storage generation and record which file changed; None means every document"""
+    global storage_generation
+    storage_generation += 1
+    if filename is None:
+        storage_changes.clear()
+    storage_changes[filename] = storage_generation
+
+def _files_changed_since(generation: int) -> Optional[List[str]]:
+    """Files stored or deleted after `generation`, or None if every document was deleted since"""
+    if storage_changes.get(None, 0) > generation:
+        return None
+    return [filename for filename, changed in storage_changes.items() if changed > generation]
+
+async def _store_and_invalidate(filename: str, text: str, chunks: List[str], content_hash: str,
+                                page_count: Optional[int] = None,
+                                chunk_pages: Optional[List[List[int]]] = None) -> str:
+    """Store a document's chunks and drop every cache that could still serve the old document set"""
+    storage = await run_blocking(
+        "io", _store_document, filename, text, chunks, content_hash, page_count, chunk_pages
+    )
+    _note_storage_change(filename)
+    answer_cache.clear()
+    return storage
+
+def _index_is_live() -> bool:
+    # Another worker's published index counts too, this worker may just not have swapped to it yet.
+    # Without one, new chunks are picked up when the index is first built from storage.
+    return vector_store is not None or _published_version() not in (None, EMPTY_INDEX_VERSION)
+
+async def _save_upload(file: UploadFile) -> tuple:
+    """Stream an upload to a unique temp file in fixed-size chunks, hashing it on the way"""
+    UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    sha256 = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=UPLOADS_DIR, suffix=".pdf", delete=False) as buffer:
+        file_path = Path(buffer.name)
+        try:
+            while True:
+                block = await file.read(UPLOAD_CHUNK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File exceeds the upload limit of {MAX_UPLOAD_BYTES} bytes"
+                    )
+                sha256.update(block)
+                buffer.write(block)
+        except BaseException:
+            buffer.close()
+            file_path.unlink(missing_ok=True)
+            raise
+
+    return file_path, sha256.hexdigest(), size
+
+def _is_indexed(filename: str) -> bool:
+    store = vector_store
+    return store is not None and filename in _source_labels(store)
+
+async def _index_stored_document(filename: str, components: dict) -> int:
+    """Index an already stored document the live index is missing; returns the chunks added.
+    A failed indexing step (a 503 to retry, a failed job) leaves the document stored but not indexed,
+    and without this every retry would be deduplicated against it as "already ingested"."""
+    if not _index_is_live() or _is_indexed(filename):
+        return 0
+    documents = await get_documents_from_storage(components, {filename})
+    indexed_chunks = await run_blocking("cpu", _add_documents_to_vector_store, filename, documents)
+    logger.info(f"Indexed {indexed_chunks} chunks of stored document {filename} that were missing from the index")
+    return indexed_chunks
 
 @app.post("/upload-pdf")
 async def upload_pdf(
     file: UploadFile = File(...),
     components: dict = Depends(get_components)
 ):
-    global vector_store
-    
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
@@ -229,54 +1585,67 @@ async def upload_pdf(
     try:
         logger.info(f"Processing file: {file.filename}")
         
-        # Create uploads directory if it doesn't exist
-        uploads_dir = Path("uploads")
-        uploads_dir.mkdir(exist_ok=True)
-        
-        file_path = uploads_dir / file.filename
-        
-        # Write the uploaded file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Stream the upload to disk; memory stays flat regardless of file size
+        with timed("upload_read"):
+            file_path, content_hash, size = await _save_upload(file)
+
+        # Identical content was already ingested: skip extraction, and embedding unless its indexing failed
+        existing = await run_blocking("io", _find_ingested_document, content_hash)
+        if existing is not None:
+            logger.info(f"Skipping {file.filename}: same content already ingested as {existing['filename']}")
+            with timed("upload_index"):
+                indexed_chunks = await _index_stored_document(existing['filename'], components)
+            return JSONResponse(content={
+                "message": "PDF already ingested",
+                "filename": file.filename,
+                "duplicate_of": existing['filename'],
+                "content_hash": content_hash,
+                "chunks_created": existing['chunk_count'],
+                "chunks_indexed": indexed_chunks,
+                "text_length": existing['text_length']
+            })
 
         # Extract text asynchronously
-        text = await extract_text_from_pdf(str(file_path))
+        with timed("upload_extract"):
+            extracted = await extract_text_from_pdf(str(file_path))
+        text = extracted['text']
         
         # Split text into chunks
-        chunks = components["text_splitter"].split_text(text)
+        with timed("upload_split"):
+            chunks = components["text_splitter"].split_text(text)
+            chunk_pages = _chunk_pages(text, chunks, extracted['pages'])
         
         if not chunks:
             raise HTTPException(status_code=400, detail="No text chunks could be created from the PDF")
 
-        # Store in Firebase or mock storage
-        if db:
-            try:
-                doc_ref = db.collection('pdf_documents').document(file.filename)
-                doc_ref.set({
-                    'filename': file.filename,
-                    'text': text,
-                    'chunks': chunks,
-                    'timestamp': firestore.SERVER_TIMESTAMP,
-                    'chunk_count': len(chunks)
-                })
-                logger.info(f"Document stored in Firebase: {file.filename}")
-            except Exception as e:
-                logger.error(f"Firebase storage failed: {str(e)}")
-                # Fallback to mock storage
-                mock_storage.store_document(file.filename, text, chunks)
-        else:
-            mock_storage.store_document(file.filename, text, chunks)
+        # Store in Firebase or the local chunk store
+        with timed("upload_store"):
+            storage = await _store_and_invalidate(
+                file.filename, text, chunks, content_hash, extracted['page_count'], chunk_pages
+            )
         
-        # Invalidate vector store cache
-        vector_store = None
-        document_cache.clear()
+        # Update the live index in place: only the new chunks are embedded
+        indexed_chunks = 0
+        if _index_is_live():
+            new_documents = _chunks_to_documents(file.filename, chunks, storage, chunk_pages, content_hash)
+            with timed("upload_index"):
+                indexed_chunks = await run_blocking(
+                    "cpu",
+                    _add_documents_to_vector_store,
+                    file.filename,
+                    new_documents
+                )
+            logger.info(f"Added {indexed_chunks} chunks to the vector store for {file.filename}")
         
         return JSONResponse(content={
             "message": "PDF uploaded and processed successfully",
             "filename": file.filename,
             "chunks_created": len(chunks),
-            "text_length": len(text)
+            "chunks_indexed": indexed_chunks,
+            "text_length": len(text),
+            "page_count": extracted['page_count'],
+            "content_hash": content_hash,
+            "file_size": size
         })
 
     except HTTPException:
@@ -292,232 +1661,1722 @@ async def upload_pdf(
             except Exception as e:
                 logger.warning(f"Could not delete temporary file: {str(e)}")
 
-@app.delete("/delete-all-data")
-async def delete_all_data():
-    global vector_store, document_cache
-    
-    try:
-        firebase_deleted = 0
-        if db:
-            try:
-                batch = db.batch()
-                docs = db.collection('pdf_documents').limit(500).stream()
+# Ingestion jobs: /upload-pdfs saves the files and returns job IDs right away. Extraction workers run
+# extract -> split -> store for several files at once; a single indexer then embeds and indexes the
+# finished files in batches, so a folder of circulars becomes one embedding call and one published version.
+INGEST_STAGES = ("extract", "split", "store", "index")
+ingest_jobs = OrderedDict()
+ingest_queue = None
+index_queue = None
+ingest_tasks = []
 
-                for doc in docs:
-                    batch.delete(doc.reference)
-                    firebase_deleted += 1
+def _new_ingest_job(filename: str, content_hash: str, size: int) -> dict:
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "filename": filename,
+        "status": "queued",
+        "stage": "queued",
+        "progress": 0.0,
+        "file_size": size,
+        "content_hash": content_hash,
+        "page_count": None,
+        "chunks_created": None,
+        "chunks_indexed": None,
+        "text_length": None,
+        "duplicate_of": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "stage_seconds": {}
+    }
+    ingest_jobs[job["job_id"]] = job
+    # Forget the oldest finished jobs; queued and running ones are always kept
+    finished = [job_id for job_id, old in ingest_jobs.items() if old["finished_at"] is not None]
+    for job_id in finished[:max(0, len(ingest_jobs) - INGEST_JOB_RETENTION)]:
+        del ingest_jobs[job_id]
+    return job
 
-                if firebase_deleted > 0:
-                    batch.commit()
-                    logger.info(f"Deleted {firebase_deleted} documents from Firebase")
-            except Exception as e:
-                logger.warning(f"Firebase deletion failed, continuing with mock storage cleanup: {str(e)}")
+def _finish_ingest_job(job: dict, status: str, error: Optional[str] = None):
+    job["status"] = status
+    job["stage"] = status
+    job["error"] = error
+    job["finished_at"] = time.time()
+    if status != "failed":
+        job["progress"] = 1.0
+    if error:
+        logger.error(f"Ingestion job {job['job_id']} for {job['filename']} failed: {error}")
 
-        # Also clear mock storage
-        mock_storage.delete_all()
+@contextmanager
+def _job_stage(job: dict, stage: str):
+    """Track a job's current stage, and time it into the same histograms as the synchronous upload"""
+    job["stage"] = stage
+    started = time.perf_counter()
+    with timed(f"upload_{stage}"):
+        yield
+    job["stage_seconds"][stage] = time.perf_counter() - started
+    job["progress"] = (INGEST_STAGES.index(stage) + 1) / len(INGEST_STAGES)
 
-        # Invalidate caches
-        vector_store = None
-        document_cache.clear()
+async def _when_not_busy(make_call):
+    """Background work waits out a full executor queue instead of failing the way a request would"""
+    while True:
+        try:
+            return await make_call()
+        except HTTPException as e:
+            if e.status_code != 503:
+                raise
+            await asyncio.sleep(1)
 
-        return JSONResponse(content={
-            "message": "All data deleted successfully",
-            "storage": "Firebase" if db and firebase_deleted > 0 else "Mock"
-        })
+async def _run_ingest_job(job: dict, file_path: Path):
+    job["status"] = "running"
+    job["started_at"] = time.time()
+    try:
+        existing = await run_blocking("io", _find_ingested_document, job["content_hash"])
+        if existing is not None:
+            job["duplicate_of"] = existing["filename"]
+            job["chunks_created"] = existing["chunk_count"]
+            job["text_length"] = existing["text_length"]
+            with _job_stage(job, "index"):
+                components = await get_components()
+                job["chunks_indexed"] = await _when_not_busy(
+                    lambda: _index_stored_document(existing["filename"], components)
+                )
+            _finish_ingest_job(job, "duplicate")
+            return
 
-    except Exception as e:
-        logger.error(f"Error deleting data: {str(e)}")
+        with _job_stage(job, "extract"):
+            extracted = await _when_not_busy(lambda: extract_text_from_pdf(str(file_path)))
+        file_path.unlink(missing_ok=True)
+        job["page_count"] = extracted["page_count"]
+        job["text_length"] = len(extracted["text"])
+
+        with _job_stage(job, "split"):
+            chunks = await _when_not_busy(
+                lambda: run_blocking("cpu", get_text_splitter().split_text, extracted["text"])
+            )
+            chunk_pages = await run_blocking("cpu", _chunk_pages, extracted["text"], chunks, extracted["pages"])
+        if not chunks:
+            raise ValueError("No text chunks could be created from the PDF")
+        job["chunks_created"] = len(chunks)
+
+        with _job_stage(job, "store"):
+            storage = await _store_and_invalidate(
+                job["filename"], extracted["text"], chunks, job["content_hash"], extracted["page_count"],
+                chunk_pages
+            )
+
+        if not _index_is_live():
+            job["chunks_indexed"] = 0
+            _finish_ingest_job(job, "done")
+            return
+        job["stage"] = "waiting_for_index"
+        await index_queue.put((job, _chunks_to_documents(
+            job["filename"], chunks, storage, chunk_pages, job["content_hash"]
+        )))
+    except Exception as e:
+        _finish_ingest_job(job, "failed", getattr(e, 'detail', str(e)))
+    finally:
+        file_path.unlink(missing_ok=True)
+
+async def _ingest_worker():
+    while True:
+        job_id, file_path = await ingest_queue.get()
+        try:
+            await _run_ingest_job(ingest_jobs[job_id], file_path)
+        except Exception as e:
+            logger.error(f"Ingestion worker error: {str(e)}")
+        finally:
+            ingest_queue.task_done()
+
+async def _index_worker():
+    """Index whatever files finished storing since the last batch, up to INGEST_INDEX_BATCH at a time"""
+    while True:
+        batch = [await index_queue.get()]
+        while len(batch) < INGEST_INDEX_BATCH and not index_queue.empty():
+            batch.append(index_queue.get_nowait())
+        # A file uploaded twice in one batch keeps its latest chunks, same as storage
+        replacements = {job["filename"]: documents for job, documents in batch}
+        started = time.perf_counter()
+        try:
+            for job, _ in batch:
+                job["stage"] = "index"
+            with timed("upload_index"):
+                await _when_not_busy(
+                    lambda: run_blocking("cpu", _replace_documents_in_vector_store, replacements)
+                )
+            logger.info(f"Indexed {sum(len(d) for d in replacements.values())} chunks from {len(replacements)} files")
+            for job, documents in batch:
+                job["chunks_indexed"] = len(documents)
+                job["stage_seconds"]["index"] = time.perf_counter() - started
+                _finish_ingest_job(job, "done")
+        except Exception as e:
+            for job, _ in batch:
+                _finish_ingest_job(job, "failed", f"Indexing failed: {str(e)}")
+        finally:
+            for _ in batch:
+                index_queue.task_done()
+
+def _start_ingest_workers():
+    global ingest_queue, index_queue
+    if ingest_tasks:
+        return
+    ingest_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    index_queue = asyncio.Queue()
+    ingest_tasks.extend(asyncio.create_task(_ingest_worker()) for _ in range(INGEST_WORKERS))
+    ingest_tasks.append(asyncio.create_task(_index_worker()))
+    logger.info(f"Started {INGEST_WORKERS} ingestion workers")
+
+@app.on_event("shutdown")
+async def stop_ingest_workers():
+    for task in ingest_tasks:
+        task.cancel()
+    ingest_tasks.clear()
+
+@app.post("/upload-pdfs", status_code=202)
+async def upload_pdfs(
+    files: List[UploadFile] = File(...),
+    components: dict = Depends(get_components)
+):
+    """Queue many PDFs for background ingestion; returns one job per accepted file"""
+    _start_ingest_workers()
+    jobs, rejected = [], []
+    for file in files:
+        if not file.filename.lower().endswith('.pdf'):
+            rejected.append({"filename": file.filename, "error": "Only PDF files are supported"})
+            continue
+        if ingest_queue.full():
+            rejected.append({"filename": file.filename, "error": "Ingestion queue is full. Please retry shortly."})
+            continue
+        try:
+            with timed("upload_read"):
+                file_path, content_hash, size = await _save_upload(file)
+        except HTTPException as e:
+            rejected.append({"filename": file.filename, "error": e.detail})
+            continue
+        job = _new_ingest_job(file.filename, content_hash, size)
+        try:
+            # The queue can fill up while the file is being saved, by other requests
+            ingest_queue.put_nowait((job["job_id"], file_path))
+        except asyncio.QueueFull:
+            ingest_jobs.pop(job["job_id"], None)
+            file_path.unlink(missing_ok=True)
+            rejected.append({"filename": file.filename, "error": "Ingestion queue is full. Please retry shortly."})
+            continue
+        jobs.append({"job_id": job["job_id"], "filename": file.filename, "status": job["status"]})
+
+    if not jobs and rejected:
+        if ingest_queue.full():
+            raise HTTPException(status_code=503, detail={"message": "Ingestion queue is full", "rejected": rejected},
+                                headers={"Retry-After": "5"})
+        raise HTTPException(status_code=400, detail={"message": "No files were accepted", "rejected": rejected})
+    logger.info(f"Queued {len(jobs)} PDFs for ingestion ({len(rejected)} rejected)")
+    return JSONResponse(status_code=202, content={
+        "message": f"{len(jobs)} PDFs queued for processing",
+        "jobs": jobs,
+        "rejected": rejected
+    })
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return JSONResponse(content=job)
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = 100):
+    """Most recent ingestion jobs first, optionally only those with the given status"""
+    jobs = [job for job in reversed(ingest_jobs.values()) if status is None or job["status"] == status]
+    return JSONResponse(content={
+        "jobs": jobs[:max(0, limit)],
+        "total": len(jobs),
+        "queued": ingest_queue.qsize() if ingest_queue is not None else 0,
+        "waiting_for_index": index_queue.qsize() if index_queue is not None else 0
+    })
+
+def _delete_firebase_documents() -> int:
+    deleted = 0
+    collection_ref = db.collection('pdf_documents')
+    paths = None
+    while True:
+        docs, paths = _next_page(collection_ref.select([]), paths)
+        if not docs:
+            break
+        for doc in docs:
+            _delete_chunk_collections(doc.reference)
+        with _checked_bulk_writer() as writer:
+            for doc in docs:
+                writer.delete(doc.reference)
+        deleted += len(docs)
+
+    if deleted > 0:
+        logger.info(f"Deleted {deleted} documents from Firebase")
+    return deleted
+
+def _delete_firebase_document(filename: str) -> bool:
+    doc_ref = db.collection('pdf_documents').document(filename)
+    if not doc_ref.get().exists:
+        return False
+    _delete_chunk_collections(doc_ref)
+    doc_ref.delete()
+    logger.info(f"Deleted {filename} from Firebase")
+    return True
+
+@app.delete("/documents/{filename:path}", dependencies=[Depends(wait_until_warm)])
+async def delete_document(filename: str):
+    """Delete one document from storage and drop its vectors from the live index without a rebuild"""
+    try:
+        deleted = False
+        if db:
+            try:
+                deleted = await run_blocking("io", _delete_firebase_document, filename)
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.warning(f"Firebase deletion failed for {filename}: {str(e)}")
+        deleted = await run_blocking("io", chunk_store.delete_document, filename) or deleted
+
+        if not deleted:
+            raise HTTPException(status_code=404, detail=f"Document not found: {filename}")
+
+        _note_storage_change(filename)
+        answer_cache.clear()
+        await run_blocking("cpu", _add_documents_to_vector_store, filename, [])
+
+        return JSONResponse(content={
+            "message": "Document deleted successfully",
+            "filename": filename
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting {filename}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
+
+@app.delete("/delete-all-data", dependencies=[Depends(wait_until_warm)])
+async def delete_all_data():
+    try:
+        firebase_deleted = 0
+        if db:
+            try:
+                firebase_deleted = await run_blocking("io", _delete_firebase_documents)
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.warning(f"Firebase deletion failed, continuing with local storage cleanup: {str(e)}")
+
+        # Also clear the local chunk store
+        await run_blocking("io", chunk_store.delete_all)
+
+        # Invalidate caches and the persisted index; the reset waits on the cross-process publish lock
+        _note_storage_change()
+        await run_blocking("io", _reset_vector_store)
+        answer_cache.clear()
+
+        return JSONResponse(content={
+            "message": "All data deleted successfully",
+            "storage": "Firebase" if db and firebase_deleted > 0 else "Local"
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting data: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error deleting data: {str(e)}")
 
-async def get_documents_from_storage(components: dict) -> List[Document]:
+def _chunks_to_documents(filename: str, chunks: List[str], storage: str,
+                         chunk_pages: Optional[List[List[int]]] = None,
+                         content_hash: Optional[str] = None) -> List[Document]:
+    documents = []
+    for i, chunk in enumerate(chunks):
+        if chunk.strip():
+            metadata = _chunk_metadata(filename, i, storage, chunk_pages[i] if chunk_pages else None)
+            if content_hash:
+                # Recorded by the docstore, so the index can be checked against the document manifests
+                metadata['content_hash'] = content_hash
+            documents.append(Document(page_content=chunk, metadata=metadata))
+    return documents
+
+def _chunk_metadata(filename: str, chunk_id: int, storage: str, pages: Optional[List[int]] = None) -> dict:
+    # `page` is where the chunk starts, `pages` every page it spans; both are left out when unknown
+    metadata = {'source': filename, 'chunk_id': chunk_id, 'storage': storage}
+    if pages:
+        metadata['page'] = pages[0]
+        metadata['pages'] = list(pages)
+    return metadata
+
+def _document_id(document: Document) -> str:
+    # Stable per-chunk ID so a document's vectors can be found and replaced later
+    return f"{document.metadata['source']}#{document.metadata['chunk_id']}"
+
+def _split_document_id(doc_id: str) -> tuple:
+    filename, chunk_id = doc_id.rsplit('#', 1)
+    return filename, int(chunk_id)
+
+def _chunk_fingerprint(doc_id: str, content: str) -> int:
+    digest = hashlib.sha256(f"{doc_id}\0{content}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def _fingerprint_documents(documents: List[Document]) -> int:
+    # XOR of per-chunk digests: order independent and cheap to update as chunks come and go
+    fingerprint = 0
+    for document in documents:
+        fingerprint ^= _chunk_fingerprint(_document_id(document), document.page_content)
+    return fingerprint
+
+def _unique_documents(documents: List[Document]) -> List[Document]:
+    unique_documents = {}
+    for document in documents:
+        unique_documents.setdefault(_document_id(document), document)
+    return list(unique_documents.values())
+
+def _select_index_type(chunk_count: int) -> str:
+    if VECTOR_INDEX_TYPE != "auto":
+        return VECTOR_INDEX_TYPE
+    if chunk_count >= AUTO_IVFPQ_MIN_CHUNKS:
+        return "ivfpq"
+    if chunk_count >= AUTO_HNSW_MIN_CHUNKS:
+        return "hnsw"
+    return "flat"
+
+def _create_faiss_index(vectors: np.ndarray):
+    """Create (and train, if needed) a FAISS index suited to the corpus size; vectors are added by the caller"""
+    import faiss
+    count, dimension = vectors.shape
+    index_type = _select_index_type(count)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif index_type == "ivfpq":
+        nlist = IVF_NLIST or max(1, int(4 * np.sqrt(count)))
+        # k-means wants ~39 points per centroid and PQ needs 256 points per codebook
+        nlist = max(1, min(nlist, count // 39))
+        if count < 256 or dimension % PQ_M:
+            logger.warning(f"Corpus of {count} chunks is too small for IVF-PQ, using a flat index")
+            return faiss.IndexFlatL2(dimension), "flat"
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, nlist, PQ_M, 8)
+        index.train(vectors)
+        index.nprobe = IVF_NPROBE
+    elif index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    else:
+        raise ValueError(f"Unknown vector index type: {index_type}")
+
+    return index, index_type
+
+def _index_type_name(index) -> str:
+    if hasattr(index, 'hnsw'):
+        return "hnsw"
+    if hasattr(index, 'nprobe'):
+        return "ivfpq"
+    return "flat"
+
+def _build_vector_store(documents: List[Document], embedding_fn) -> "FAISS":
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    documents = _unique_documents(documents)
+    ids = [_document_id(doc) for doc in documents]
+    vectors = np.asarray(embedding_fn.embed_documents([doc.page_content for doc in documents]), dtype=np.float32)
+
+    index, index_type = _create_faiss_index(vectors)
+    index.add(vectors)
+    if index_type == "ivfpq":
+        # Hashtable direct map: vectors stay reconstructable by label and can still be removed.
+        # It has to be enabled after the first add, FAISS does not populate it on an empty index.
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    logger.info(f"Built {index_type} index over {len(documents)} chunks")
+
+    return FAISS(
+        embedding_function=embedding_fn,
+        index=index,
+        docstore=ChunkDocstore.from_documents(dict(zip(ids, documents))),
+        index_to_docstore_id=dict(enumerate(ids))
+    )
+
+def _copy_vector_store(store: "FAISS") -> "FAISS":
+    """Writable copy for copy-on-write updates: searches keep reading the old store until the new one is swapped in"""
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    return FAISS(
+        embedding_function=store.embedding_function,
+        index=faiss.clone_index(store.index),
+        docstore=store.docstore.copy(),
+        index_to_docstore_id=dict(store.index_to_docstore_id)
+    )
+
+def _add_to_vector_store(store: "FAISS", documents: List[Document]):
+    ids = [_document_id(doc) for doc in documents]
+    vectors = np.asarray(store.embedding_function.embed_documents([doc.page_content for doc in documents]), dtype=np.float32)
+
+    if hasattr(store.index, 'nprobe'):
+        # IVF labels are explicit and survive removals, so new vectors get fresh labels past the largest one
+        start = max(store.index_to_docstore_id, default=-1) + 1
+        labels = np.arange(start, start + len(ids), dtype=np.int64)
+        store.index.add_with_ids(vectors, labels)
+    else:
+        # Flat and HNSW indexes number vectors by insertion position
+        labels = range(store.index.ntotal, store.index.ntotal + len(ids))
+        store.index.add(vectors)
+
+    store.docstore.add(dict(zip(ids, documents)))
+    store.index_to_docstore_id.update(zip((int(label) for label in labels), ids))
+
+def _remove_from_vector_store(store: "FAISS", doc_ids: List[str]):
+    doc_ids = set(doc_ids)
+    labels = [label for label, doc_id in store.index_to_docstore_id.items() if doc_id in doc_ids]
+    # The chunk text is forgotten by the caller once the store without these chunks is live
+    store.docstore.discard(list(doc_ids))
+
+    if hasattr(store.index, 'hnsw'):
+        # The vectors stay in the graph; labels missing from the map are tombstones (see _tombstone_selector)
+        for label in labels:
+            del store.index_to_docstore_id[label]
+        _compact_hnsw_if_needed(store)
+        return
+    store.index.remove_ids(np.asarray(labels, dtype=np.int64))
+    if hasattr(store.index, 'nprobe'):
+        for label in labels:
+            del store.index_to_docstore_id[label]
+    else:
+        # A flat index compacts on removal: remaining vectors shift down, keeping their order
+        remaining = [doc_id for _, doc_id in sorted(store.index_to_docstore_id.items()) if doc_id not in doc_ids]
+        store.index_to_docstore_id.clear()
+        store.index_to_docstore_id.update(enumerate(remaining))
+
+def _compact_hnsw_if_needed(store: "FAISS"):
+    """Rebuild the HNSW graph from its live vectors once too many are tombstoned; no re-embedding needed"""
+    import faiss
+    index = store.index
+    live = len(store.index_to_docstore_id)
+    if index.ntotal == live or (index.ntotal - live) < HNSW_COMPACT_FRACTION * index.ntotal:
+        return
+    labels = sorted(store.index_to_docstore_id)
+    compacted = faiss.IndexHNSWFlat(index.d, index.hnsw.nb_neighbors(1))
+    compacted.hnsw.efConstruction = index.hnsw.efConstruction
+    compacted.hnsw.efSearch = index.hnsw.efSearch
+    if labels:
+        compacted.add(index.reconstruct_batch(np.asarray(labels, dtype=np.int64)))
+    remaining = [store.index_to_docstore_id[label] for label in labels]
+    store.index = compacted
+    store.index_to_docstore_id.clear()
+    store.index_to_docstore_id.update(enumerate(remaining))
+    logger.info(f"Compacted HNSW index: dropped {index.ntotal - live} tombstoned vectors, {live} left")
+
+def _tombstone_selector(store: "FAISS"):
+    """Selector excluding the tombstoned labels of an HNSW index, or None when it has none"""
+    global tombstone_selector_cache
+    import faiss
+    if not hasattr(store.index, 'hnsw') or store.index.ntotal == len(store.index_to_docstore_id):
+        return None
+    key = (id(store), vector_store_version, store.index.ntotal, len(store.index_to_docstore_id))
+    if tombstone_selector_cache[0] != key:
+        alive = np.zeros(store.index.ntotal, dtype=bool)
+        alive[np.fromiter(store.index_to_docstore_id, dtype=np.int64, count=len(store.index_to_docstore_id))] = True
+        dead = faiss.IDSelectorBatch(np.flatnonzero(~alive).astype(np.int64))
+        # IDSelectorNot does not own the wrapped selector, so keep both alive together
+        tombstone_selector_cache = (key, (faiss.IDSelectorNot(dead), dead))
+    return tombstone_selector_cache[1][0]
+
+def _search_parameters(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None, selector=None):
+    # Per-query parameters, so concurrent searches never race on shared index settings
+    import faiss
+    if hasattr(index, 'nprobe') and (nprobe or selector):
+        return faiss.SearchParametersIVF(nprobe=nprobe or index.nprobe, sel=selector)
+    if hasattr(index, 'hnsw') and (ef_search or selector):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or index.hnsw.efSearch, sel=selector)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+def _source_labels(store: "FAISS") -> dict:
+    """Map each source file to the index labels of its chunks; rebuilt only when the index changes"""
+    global source_labels_cache
+    key = (id(store), vector_store_version, store.index.ntotal)
+    if source_labels_cache[0] != key:
+        labels = {}
+        for label, doc_id in store.index_to_docstore_id.items():
+            labels.setdefault(doc_id.rsplit('#', 1)[0], []).append(label)
+        source_labels_cache = (key, {source: np.asarray(ids, dtype=np.int64) for source, ids in labels.items()})
+    return source_labels_cache[1]
+
+def _search_vector_store(store: "FAISS", query_vector, k: int, nprobe: Optional[int] = None,
+                         ef_search: Optional[int] = None, sources: Optional[List[str]] = None) -> List[tuple]:
+    """Return (document, L2 distance) pairs for the k nearest chunks, optionally only from the given sources"""
+    return _search_vector_store_batch(store, [query_vector], k, nprobe, ef_search, sources)[0]
+
+def _search_vector_store_batch(store: "FAISS", query_vectors, k: int, nprobe: Optional[int] = None,
+                               ef_search: Optional[int] = None, sources: Optional[List[str]] = None) -> List[List[tuple]]:
+    """Search all query vectors in one FAISS call; one list of (document, L2 distance) pairs per query"""
+    queries = np.asarray(query_vectors, dtype=np.float32)
+
+    if sources:
+        partitions = _source_labels(store)
+        labels = np.concatenate([partitions.get(source, np.empty(0, dtype=np.int64)) for source in sources])
+        if len(labels) == 0:
+            return [[] for _ in range(len(queries))]
+        if len(labels) <= SCOPED_SEARCH_EXACT_LIMIT:
+            # Compare against this partition's vectors only
+            vectors = store.index.reconstruct_batch(labels)
+            distances = (
+                (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+            )
+            order = np.argsort(distances, axis=1)[:, :k]
+            distances = np.take_along_axis(distances, order, axis=1)
+            positions = labels[order]
+        else:
+            import faiss
+            selector = faiss.IDSelectorBatch(labels)
+            params = _search_parameters(store.index, nprobe, ef_search, selector)
+            distances, positions = store.index.search(queries, k, params=params)
+    else:
+        params = _search_parameters(store.index, nprobe, ef_search, _tombstone_selector(store))
+        distances, positions = store.index.search(queries, k, params=params)
+
+    # Text is read from the chunk store for the hits only, in one read for the whole batch
+    hit_ids = [
+        [(store.index_to_docstore_id[int(position)], float(distance))
+         for distance, position in zip(row_distances, row_positions) if int(position) in store.index_to_docstore_id]
+        for row_distances, row_positions in zip(distances, positions)
+    ]
+    documents = _get_documents_by_id(store, [doc_id for hits in hit_ids for doc_id, _ in hits])
+    return [
+        [(documents[doc_id], distance) for doc_id, distance in hits if doc_id in documents]
+        for hits in hit_ids
+    ]
+
+def _get_documents_by_id(store: "FAISS", doc_ids: List[str]) -> dict:
+    """Materialize chunks by ID; chunks whose text is gone (replaced since this index was built) are left out"""
+    doc_ids = list(dict.fromkeys(doc_ids))
+    return {doc_id: doc for doc_id, doc in zip(doc_ids, store.docstore.mget(doc_ids)) if doc is not None}
+
+def _retrieve_documents(store: "FAISS", query: str, k: int, nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None, sources: Optional[List[str]] = None,
+                        query_vector=None) -> List[tuple]:
+    """Search with query_vector when the caller has already embedded the query, else embed it here"""
+    if query_vector is None:
+        query_vector = store.embedding_function.embed_query(query)
+    return _search_vector_store(store, query_vector, k, nprobe, ef_search, sources)
+
+# Keyword index: BM25 over the same chunks as the vector store, so exact names, ward numbers and dates match.
+# Postings live in a read-only segment of numpy arrays that is published with each index version and
+# memory-mapped on load, so workers share one copy and a hot-swap reads no chunk text. Chunks added since
+# the segment was built go to a small in-memory overlay; removed ones are tombstoned until the next compaction.
+BM25_SEGMENT_ARRAYS = ("term_hashes", "offsets", "post_rows", "post_tfs", "row_source", "row_chunk", "row_length")
+
+def _term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode(), digest_size=8).digest(), "little")
+
+def _bm25_segment(post_hashes, post_rows, post_tfs, row_source, row_chunk, row_length) -> dict:
+    """Group postings by term hash; rows must already be numbered in (source, chunk) order"""
+    post_hashes = np.asarray(post_hashes, dtype=np.uint64)
+    post_rows = np.asarray(post_rows, dtype=np.int32)
+    order = np.lexsort((post_rows, post_hashes))
+    post_hashes = post_hashes[order]
+    term_hashes, starts = np.unique(post_hashes, return_index=True)
+    return {
+        "term_hashes": term_hashes,
+        "offsets": np.append(starts, len(post_hashes)).astype(np.int64),
+        "post_rows": post_rows[order],
+        "post_tfs": np.asarray(post_tfs, dtype=np.int32)[order],
+        "row_source": np.asarray(row_source, dtype=np.int32),
+        "row_chunk": np.asarray(row_chunk, dtype=np.int32),
+        "row_length": np.asarray(row_length, dtype=np.int32),
+    }
+
+class BM25Index:
+    """Okapi BM25 over a read-only postings segment plus an overlay of chunks updated since it was built"""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B, segment: Optional[dict] = None,
+                 sources: Optional[List[str]] = None):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # overlay: term -> {doc_id: term frequency}
+        self.doc_terms = {}  # overlay: doc_id -> distinct terms, so removal only touches its own postings
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.lock = threading.Lock()
+        self.segment_path = None  # a published version directory holding this segment's files
+        self._set_segment(segment or _bm25_segment([], [], [], [], [], []), sources or [])
+
+    def _set_segment(self, segment: dict, sources: List[str]):
+        self.segment = segment
+        self.segment_id = uuid.uuid4().hex
+        self.sources = sources  # sorted; row_source indexes into it
+        self.source_index = {source: i for i, source in enumerate(sources)}
+        self.source_starts = np.searchsorted(segment["row_source"], np.arange(len(sources) + 1))
+        self.segment_length = int(segment["row_length"].sum())
+        self.dead = np.zeros(len(segment["row_chunk"]), dtype=bool)
+        self.dead_length = 0
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return re.findall(r"\w+", text.lower())
+
+    @staticmethod
+    def _count(text: str) -> dict:
+        counts = {}
+        for token in BM25Index.tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        return counts
+
+    @classmethod
+    def from_documents(cls, documents: List[Document]) -> "BM25Index":
+        """Build straight into a segment, in (source, chunk) row order"""
+        chunks = sorted((_split_document_id(_document_id(document)), document.page_content) for document in documents)
+        sources = sorted({source for (source, _), _ in chunks})
+        source_index = {source: i for i, source in enumerate(sources)}
+        vocabulary = {}
+        term_ids, post_rows, post_tfs, row_length = [], [], [], []
+        for row, (_, text) in enumerate(chunks):
+            counts = cls._count(text)
+            for term, count in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                post_rows.append(row)
+                post_tfs.append(count)
+            row_length.append(sum(counts.values()))
+        hashes = np.fromiter((_term_hash(term) for term in vocabulary), dtype=np.uint64, count=len(vocabulary))
+        segment = _bm25_segment(
+            hashes[np.asarray(term_ids, dtype=np.int64)], post_rows, post_tfs,
+            [source_index[source] for (source, _), _ in chunks], [chunk_id for (_, chunk_id), _ in chunks], row_length
+        )
+        return cls(segment=segment, sources=sources)
+
+    def _segment_row(self, doc_id: str) -> Optional[int]:
+        filename, chunk_id = _split_document_id(doc_id)
+        source = self.source_index.get(filename)
+        if source is None:
+            return None
+        start, stop = self.source_starts[source], self.source_starts[source + 1]
+        position = start + int(np.searchsorted(self.segment["row_chunk"][start:stop], chunk_id))
+        if position < stop and self.segment["row_chunk"][position] == chunk_id and not self.dead[position]:
+            return position
+        return None
+
+    def add(self, doc_id: str, text: str):
+        self._add_counts(doc_id, self._count(text))
+
+    def _add_counts(self, doc_id: str, counts: dict):
+        with self.lock:
+            self._remove(doc_id)
+            for term, count in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = count
+            self.doc_terms[doc_id] = tuple(counts)
+            self.doc_lengths[doc_id] = sum(counts.values())
+            self.total_length += self.doc_lengths[doc_id]
+
+    def add_documents(self, documents: List[Document]):
+        for document in documents:
+            self.add(_document_id(document), document.page_content)
+
+    def remove(self, doc_ids: List[str]):
+        with self.lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        if doc_id in self.doc_lengths:
+            for term in self.doc_terms.pop(doc_id):
+                posting = self.postings[term]
+                del posting[doc_id]
+                if not posting:
+                    del self.postings[term]
+            self.total_length -= self.doc_lengths.pop(doc_id)
+            return
+        row = self._segment_row(doc_id)
+        if row is not None:
+            self.dead[row] = True
+            self.dead_length += int(self.segment["row_length"][row])
+
+    def search(self, query: str, k: int, sources: Optional[List[str]] = None) -> List[tuple]:
+        """Top-k (doc_id, score) pairs, optionally only from the given source files"""
+        allowed = set(sources) if sources else None
+        hashes = {term: _term_hash(term) for term in set(self.tokenize(query))}
+        scores = {}
+        with self.lock:
+            doc_count = len(self)
+            if not doc_count:
+                return []
+            segment = self.segment
+            average_length = (self.segment_length - self.dead_length + self.total_length) / doc_count or 1.0
+            segment_scores = np.zeros(len(self.dead))
+            allowed_rows = None
+            if allowed is not None:
+                allowed_rows = np.zeros(len(self.dead), dtype=bool)
+                for source in allowed & self.source_index.keys():
+                    index = self.source_index[source]
+                    allowed_rows[self.source_starts[index]:self.source_starts[index + 1]] = True
+            for term, term_hash in hashes.items():
+                rows = tfs = None
+                position = int(np.searchsorted(segment["term_hashes"], np.uint64(term_hash)))
+                if position < len(segment["term_hashes"]) and segment["term_hashes"][position] == term_hash:
+                    start, stop = segment["offsets"][position], segment["offsets"][position + 1]
+                    rows, tfs = segment["post_rows"][start:stop], segment["post_tfs"][start:stop]
+                    live = ~self.dead[rows]
+                    rows, tfs = rows[live], tfs[live]
+                posting = self.postings.get(term, {})
+                frequency_of_term = (len(rows) if rows is not None else 0) + len(posting)
+                if not frequency_of_term:
+                    continue
+                idf = math.log(1 + (doc_count - frequency_of_term + 0.5) / (frequency_of_term + 0.5))
+                if rows is not None and len(rows):
+                    if allowed_rows is not None:
+                        keep = allowed_rows[rows]
+                        rows, tfs = rows[keep], tfs[keep]
+                    norm = self.k1 * (1 - self.b + self.b * segment["row_length"][rows] / average_length)
+                    # A term's postings name each row once, so plain fancy-index addition is safe
+                    segment_scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+                for doc_id, frequency in posting.items():
+                    if allowed is not None and doc_id.rsplit('#', 1)[0] not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+            scored = np.flatnonzero(segment_scores)
+            if len(scored) > k:
+                scored = scored[np.argpartition(-segment_scores[scored], k - 1)[:k]]
+            for row in scored:
+                doc_id = f"{self.sources[segment['row_source'][row]]}#{segment['row_chunk'][row]}"
+                scores[doc_id] = float(segment_scores[row])
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def __len__(self):
+        return len(self.dead) - int(np.count_nonzero(self.dead)) + len(self.doc_lengths)
+
+    def needs_compaction(self) -> bool:
+        churn = len(self.doc_lengths) + int(np.count_nonzero(self.dead))
+        return churn > max(BM25_OVERLAY_MIN_CHUNKS, BM25_OVERLAY_FRACTION * len(self))
+
+    def compact(self):
+        """Fold the overlay and tombstones into a fresh segment. Callers hold the publish lock, so nothing
+        else changes the index meanwhile; searches keep reading the old segment until the swap."""
+        segment = self.segment
+        live = np.flatnonzero(~self.dead)
+        keys = [(self.sources[source], int(chunk)) for source, chunk in
+                zip(segment["row_source"][live], segment["row_chunk"][live])]
+        overlay = list(self.doc_lengths)
+        keys += [_split_document_id(doc_id) for doc_id in overlay]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        rank = np.empty(len(keys), dtype=np.int32)
+        rank[np.asarray(order, dtype=np.int64)] = np.arange(len(keys), dtype=np.int32)
+
+        # Surviving segment postings, renumbered
+        new_row_of = np.full(len(self.dead), -1, dtype=np.int32)
+        new_row_of[live] = rank[:len(live)]
+        post_hashes = np.repeat(segment["term_hashes"], np.diff(segment["offsets"]))
+        post_rows = new_row_of[segment["post_rows"]]
+        kept = post_rows >= 0
+        hash_parts, row_parts, tf_parts = [post_hashes[kept]], [post_rows[kept]], [segment["post_tfs"][kept]]
+
+        # Overlay postings
+        overlay_rank = {doc_id: int(rank[len(live) + i]) for i, doc_id in enumerate(overlay)}
+        hashes, rows, tfs = [], [], []
+        for term, posting in self.postings.items():
+            term_hash = _term_hash(term)
+            for doc_id, frequency in posting.items():
+                hashes.append(term_hash)
+                rows.append(overlay_rank[doc_id])
+                tfs.append(frequency)
+        hash_parts.append(np.asarray(hashes, dtype=np.uint64))
+        row_parts.append(np.asarray(rows, dtype=np.int32))
+        tf_parts.append(np.asarray(tfs, dtype=np.int32))
+
+        lengths = np.concatenate([
+            segment["row_length"][live], np.asarray([self.doc_lengths[doc_id] for doc_id in overlay], dtype=np.int32)
+        ])
+        sorted_keys = [keys[i] for i in order]
+        sources = sorted({source for source, _ in sorted_keys})
+        source_index = {source: i for i, source in enumerate(sources)}
+        compacted = _bm25_segment(
+            np.concatenate(hash_parts), np.concatenate(row_parts), np.concatenate(tf_parts),
+            [source_index[source] for source, _ in sorted_keys], [chunk_id for _, chunk_id in sorted_keys],
+            lengths[np.asarray(order, dtype=np.int64)] if keys else lengths
+        )
+        with self.lock:
+            self._set_segment(compacted, sources)
+            self.segment_path = None
+            self.postings, self.doc_terms, self.doc_lengths, self.total_length = {}, {}, {}, 0
+
+    def save(self, directory: Path):
+        """Write the index into a version directory, hard-linking segment files an earlier version already holds"""
+        import pickle
+        for name in BM25_SEGMENT_ARRAYS:
+            filename = f"bm25-{self.segment_id}-{name}.npy"
+            if self.segment_path is not None:
+                try:
+                    os.link(self.segment_path / filename, directory / filename)
+                    continue
+                except OSError:
+                    pass
+            np.save(directory / filename, self.segment[name])
+        with self.lock:
+            overlay = {
+                doc_id: {term: self.postings[term][doc_id] for term in terms}
+                for doc_id, terms in self.doc_terms.items()
+            }
+            dead = np.flatnonzero(self.dead)
+        with open(directory / "bm25.pkl", "wb") as f:
+            pickle.dump({"segment_id": self.segment_id, "sources": self.sources, "dead": dead, "overlay": overlay}, f)
+
+    @classmethod
+    def load(cls, directory: Path) -> "BM25Index":
+        """Memory-map a saved segment read-only and restore the overlay and tombstones on top of it"""
+        import pickle
+        with open(directory / "bm25.pkl", "rb") as f:
+            state = pickle.load(f)
+        segment = {
+            name: np.load(directory / f"bm25-{state['segment_id']}-{name}.npy", mmap_mode="r")
+            for name in BM25_SEGMENT_ARRAYS
+        }
+        index = cls(segment=segment, sources=state["sources"])
+        index.segment_id = state["segment_id"]
+        index.segment_path = directory
+        index.dead[state["dead"]] = True
+        index.dead_length = int(segment["row_length"][state["dead"]].sum())
+        for doc_id, counts in state["overlay"].items():
+            index._add_counts(doc_id, counts)
+        return index
+
+def _build_keyword_index(documents: List[Document]) -> BM25Index:
+    return BM25Index.from_documents(_unique_documents(documents))
+
+def _hybrid_retrieve(store: "FAISS", query: str, k: int, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None, sources: Optional[List[str]] = None,
+                     query_vector=None) -> List[tuple]:
+    """Fuse vector and BM25 rankings with reciprocal rank fusion; returns (doc, fused score) pairs"""
+    keywords = keyword_index
+    if keywords is None:
+        return _retrieve_documents(store, query, k, nprobe, ef_search, sources, query_vector)
+    candidates = k * HYBRID_CANDIDATES
+    vector_hits = _retrieve_documents(store, query, candidates, nprobe, ef_search, sources, query_vector)
+    return _fuse_rankings(store, vector_hits, keywords.search(query, candidates, sources), k)
+
+def _fuse_rankings(store: "FAISS", vector_hits: List[tuple], keyword_hits: List[tuple], k: int) -> List[tuple]:
+    fused = {}
+    documents = {}
+    for rank, (doc, _) in enumerate(vector_hits):
+        doc_id = _document_id(doc)
+        documents[doc_id] = doc
+        fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    for rank, (doc_id, _) in enumerate(keyword_hits):
+        fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    documents.update(_get_documents_by_id(store, [doc_id for doc_id, _ in ranked if doc_id not in documents]))
+    # The keyword index can briefly run ahead of the store being searched during a swap
+    return [(documents[doc_id], score) for doc_id, score in ranked if doc_id in documents][:k]
+
+def _retrieve_documents_batch(store: "FAISS", queries: List[str], k: int, nprobe: Optional[int] = None,
+                              ef_search: Optional[int] = None, sources: Optional[List[str]] = None,
+                              hybrid: bool = False) -> tuple:
+    """Embed all queries in one call and search them in one FAISS call; returns (hits per query, query vectors)"""
+    query_vectors = np.asarray(store.embedding_function.embed_queries(queries), dtype=np.float32)
+    keywords = keyword_index if hybrid else None
+    if keywords is None:
+        return _search_vector_store_batch(store, query_vectors, k, nprobe, ef_search, sources), query_vectors
+
+    candidates = k * HYBRID_CANDIDATES
+    vector_hits = _search_vector_store_batch(store, query_vectors, candidates, nprobe, ef_search, sources)
+    results = [
+        _fuse_rankings(store, hits, keywords.search(query, candidates, sources), k)
+        for query, hits in zip(queries, vector_hits)
+    ]
+    return results, query_vectors
+
+def _install_vector_store(store: Optional["FAISS"], version: Optional[str], keywords: Optional[BM25Index],
+                          mapped: bool = False):
+    global vector_store, vector_store_version, vector_store_fingerprint, keyword_index, vector_store_mapped
+    with vector_store_lock:
+        vector_store = store
+        keyword_index = keywords
+        vector_store_version = version
+        vector_store_fingerprint = int(version, 16) if version else 0
+        vector_store_mapped = mapped
+
+def _rebuild_vector_store(documents: List[Document], embedding_fn) -> "FAISS":
+    """Build a fresh index from the full document set, swap it in and persist it"""
+    store = _build_vector_store(documents, embedding_fn)
+    unique = _unique_documents(documents)
+    keywords = _build_keyword_index(unique)
+    version = f"{_fingerprint_documents(unique):016x}"
+    with _index_publish_lock():
+        _install_vector_store(store, version, keywords)
+        _persist_vector_store(store, version, keywords)
+    return store
+
+def _add_documents_to_vector_store(filename: str, documents: List[Document]) -> int:
+    """Embed only the new chunks and add them to the live index, replacing any previous version of the file;
+    with no documents this just removes the file's vectors"""
+    return _replace_documents_in_vector_store({filename: documents})
+
+def _replace_documents_in_vector_store(replacements: dict) -> int:
+    """Replace the chunks of several files at once: one embedding call and one published version for all"""
+    documents = [document for file_documents in replacements.values() for document in file_documents]
+    with _index_publish_lock():
+        # Another worker may have published since our last swap; start from its version, in writable memory
+        _sync_for_write(get_embedding_model())
+        if vector_store is None:
+            return 0
+        store = vector_store
+        stale_ids = [
+            doc_id for doc_id in store.index_to_docstore_id.values()
+            if doc_id.rsplit('#', 1)[0] in replacements
+        ]
+        # Searches run without a lock, so the change is applied to a copy of the index and its label map and
+        # both are swapped in together; removals would otherwise shift positions under in-flight searches
+        store = _copy_vector_store(store)
+        # The chunk store may already hold the new text under these IDs; the docstore kept the old fingerprints
+        fingerprint = vector_store_fingerprint
+        for doc_id in stale_ids:
+            fingerprint ^= store.docstore.fingerprint(doc_id)
+        if stale_ids:
+            _remove_from_vector_store(store, stale_ids)
+        if documents:
+            _add_to_vector_store(store, documents)
+            fingerprint ^= _fingerprint_documents(documents)
+        version = f"{fingerprint:016x}"
+        _install_vector_store(store, version, keyword_index)
+        # Shared state changes only once the new store is live, so a failed embedding leaves the old one intact;
+        # keyword hits missing from the store being searched are dropped when the rankings are fused
+        if keyword_index is not None:
+            keyword_index.remove(stale_ids)
+            keyword_index.add_documents(documents)
+        forgotten = set(stale_ids).difference(_document_id(document) for document in documents)
+        if forgotten:
+            chunk_store.forget_chunks([_split_document_id(doc_id) for doc_id in forgotten])
+        _persist_soon(store, version, keyword_index)
+    return len(documents)
+
+# Persisted index: one directory per document-set version plus a CURRENT marker. Workers publish new
+# versions under a file lock and the others hot-swap to them (see _watch_published_index).
+EMPTY_INDEX_VERSION = "empty"  # CURRENT after delete-all-data, so other workers drop their index too
+
+@contextmanager
+def _index_publish_lock():
+    """Exclusive across processes sharing VECTOR_INDEX_DIR and within this one; re-entrant. Blocks for as long
+    as another worker holds it, so never take it (or vector_store_lock) on the event loop.
+    The file lock outlives the block while a deferred write is pending (see _persist_soon)."""
+    global index_lock_file, index_lock_depth
+    with vector_store_lock:
+        if index_lock_file is None and fcntl is not None:
+            VECTOR_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            index_lock_file = open(VECTOR_INDEX_DIR / ".lock", "w")
+            try:
+                fcntl.flock(index_lock_file, fcntl.LOCK_EX)
+            except BaseException:
+                index_lock_file.close()
+                index_lock_file = None
+                raise
+        index_lock_depth += 1
+        try:
+            yield
+        finally:
+            index_lock_depth -= 1
+            if index_lock_depth == 0 and pending_persist is None and index_lock_file is not None:
+                fcntl.flock(index_lock_file, fcntl.LOCK_UN)
+                index_lock_file.close()
+                index_lock_file = None
+
+def _published_version() -> Optional[str]:
     try:
-        # Check cache first
-        cache_key = "all_documents"
-        if cache_key in document_cache:
-            cache_time, cached_docs = document_cache[cache_key]
-            if time.time() - cache_time < 300:  # 5 minute cache
-                return cached_docs
-
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            documents = await loop.run_in_executor(pool, _get_documents_from_storage, components)
-        
-        # Cache the results
-        document_cache[cache_key] = (time.time(), documents)
-        return documents
-        
+        return (VECTOR_INDEX_DIR / "CURRENT").read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _write_current_marker(version: str):
+    marker_tmp = VECTOR_INDEX_DIR / f"CURRENT.{os.getpid()}.tmp"
+    marker_tmp.write_text(version)
+    os.replace(marker_tmp, VECTOR_INDEX_DIR / "CURRENT")
+
+def _sync_for_write(embedding_fn):
+    """With the publish lock held: make the live index the latest published version, loaded writable"""
+    if pending_persist is not None:
+        # The live index is ahead of CURRENT, and no other worker can have published since: we held the lock
+        return
+    published = _published_version()
+    if published == EMPTY_INDEX_VERSION:
+        if vector_store is not None:
+            _install_vector_store(None, None, None)
+    elif published is not None and (published != vector_store_version or vector_store_mapped):
+        _load_published_vector_store(embedding_fn, mapped=False)
+
+def _persist_soon(store: "FAISS", version: str, keywords: Optional[BM25Index]):
+    """With the publish lock held: write the live index within INDEX_PERSIST_INTERVAL, keeping the lock until then"""
+    global pending_persist, persist_timer
+    if INDEX_PERSIST_INTERVAL <= 0:
+        _persist_vector_store(store, version, keywords)
+        return
+    pending_persist = (store, version, keywords)
+    if persist_timer is None:
+        persist_timer = threading.Timer(INDEX_PERSIST_INTERVAL, _flush_pending_persist)
+        persist_timer.daemon = True
+        persist_timer.start()
+
+def _flush_pending_persist():
+    """Write a deferred index version and release the publish lock it was holding"""
+    global persist_timer
+    with _index_publish_lock():
+        if persist_timer is not None:
+            persist_timer.cancel()
+            persist_timer = None
+        if pending_persist is not None:
+            _persist_vector_store(*pending_persist)
+
+def _persist_vector_store(store: "FAISS", version: str, keywords: Optional[BM25Index] = None):
+    """Write a version and point CURRENT at it; this supersedes any deferred write"""
+    import faiss
+    import pickle
+    global pending_persist
+    pending_persist = None
+    try:
+        VECTOR_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        target = VECTOR_INDEX_DIR / version
+        if not target.exists():
+            staging = VECTOR_INDEX_DIR / f".{version}.{os.getpid()}.tmp"
+            staging.mkdir(parents=True)
+            faiss.write_index(store.index, str(staging / "index.faiss"))
+            with open(staging / "index.pkl", "wb") as f:
+                # Plain data only, so workers can load it whatever module name this one runs under
+                pickle.dump((store.docstore.to_dict(), store.index_to_docstore_id), f)
+            (staging / "manifest.json").write_text(json.dumps({
+                'version': version,
+                'embedding_model': embedding_model_id(),
+                'index_type': _index_type_name(store.index),
+                'chunk_count': len(store.index_to_docstore_id),
+                'created_at': time.time()
+            }))
+            if keywords is not None:
+                if keywords.needs_compaction():
+                    keywords.compact()
+                keywords.save(staging)
+            try:
+                staging.rename(target)
+                if keywords is not None:
+                    keywords.segment_path = target
+            except OSError:
+                # Another process published the same version first
+                shutil.rmtree(staging, ignore_errors=True)
+
+        _write_current_marker(version)
+
+        # Keep the current and the previous version only
+        versions = sorted(
+            (path for path in VECTOR_INDEX_DIR.iterdir() if path.is_dir() and not path.name.startswith('.')),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True
+        )
+        for path in versions:
+            if path.name != version and path not in versions[:2]:
+                shutil.rmtree(path, ignore_errors=True)
+        logger.info(f"Vector store persisted as version {version}")
+    except Exception as e:
+        logger.warning(f"Could not persist vector store: {str(e)}")
+
+def _flat_index_mmap_supported() -> bool:
+    import faiss
+    return hasattr(faiss, "IO_FLAG_MMAP_IFC")
+
+def _read_vector_store(version: str, embedding_fn, mapped: bool) -> tuple:
+    """Load a published version; returns (store, mapped) or (None, False) if it was built for another model"""
+    import faiss
+    import pickle
+    from langchain_community.vectorstores import FAISS
+    index_path = VECTOR_INDEX_DIR / version
+    manifest = json.loads((index_path / "manifest.json").read_text())
+    if manifest.get('embedding_model') != embedding_model_id():
+        logger.warning(f"Persisted vector store was built with {manifest.get('embedding_model')}, ignoring it")
+        return None, False
+
+    # IVF maps its inverted lists, flat and HNSW their vectors (IO_FLAG_MMAP_IFC, FAISS >= 1.10)
+    flags = 0
+    if mapped:
+        mmap_flag = faiss.IO_FLAG_MMAP if manifest.get('index_type') == "ivfpq" else getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        mapped = mmap_flag != 0
+        flags = mmap_flag | faiss.IO_FLAG_READ_ONLY if mapped else 0
+    index = faiss.read_index(str(index_path / "index.faiss"), flags)
+    with open(index_path / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    if isinstance(docstore, dict):
+        docstore = ChunkDocstore(**docstore)
+    else:
+        # Written before the chunk store: move the text out of the pickled InMemoryDocstore
+        docstore = ChunkDocstore.from_documents(docstore._dict)
+    store = FAISS(
+        embedding_function=embedding_fn,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id
+    )
+    return store, mapped
+
+def _load_published_vector_store(embedding_fn, mapped: bool = INDEX_MMAP) -> bool:
+    """Swap in the version CURRENT names, with a fresh keyword index; False if there is nothing to load"""
+    version = _published_version()
+    if version is None or version == EMPTY_INDEX_VERSION:
+        return False
+    store, mapped = _read_vector_store(version, embedding_fn, mapped)
+    if store is None:
+        return False
+
+    index_path = VECTOR_INDEX_DIR / version
+    if (index_path / "bm25.pkl").exists():
+        keywords = BM25Index.load(index_path)
+    else:
+        # Published before keyword indexes were: rebuild it from the chunk text once
+        documents = list(_get_documents_by_id(store, list(store.index_to_docstore_id.values())).values())
+        keywords = _build_keyword_index(documents)
+    with vector_store_lock:
+        # A write in this process may have published a newer version meanwhile, or not yet written its own
+        if _published_version() != version or pending_persist is not None:
+            return False
+        _install_vector_store(store, version, keywords, mapped)
+    logger.info(f"Loaded vector store {version} with {len(store.index_to_docstore_id)} chunks"
+                f"{' (memory-mapped)' if mapped else ''}")
+    return True
+
+def _clear_persisted_vector_store():
+    if not VECTOR_INDEX_DIR.exists():
+        return
+    # The lock file stays: other workers may be waiting on it
+    for path in VECTOR_INDEX_DIR.iterdir():
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+    _write_current_marker(EMPTY_INDEX_VERSION)
+
+def _reset_vector_store():
+    global pending_persist
+    with _index_publish_lock():
+        pending_persist = None
+        _install_vector_store(None, None, None)
+        _clear_persisted_vector_store()
+
+async def _watch_published_index():
+    """Hot-swap to index versions published by other workers sharing VECTOR_INDEX_DIR"""
+    while True:
+        await asyncio.sleep(INDEX_WATCH_INTERVAL)
+        try:
+            published = await run_blocking("io", _published_version)
+            if published is None or published == vector_store_version or pending_persist is not None:
+                continue
+            if published == EMPTY_INDEX_VERSION:
+                if vector_store is not None:
+                    # vector_store_lock can be held for a whole embedding call by an incremental update
+                    await run_blocking("io", _install_vector_store, None, None, None)
+                    logger.info("Index was cleared by another worker")
+            else:
+                await run_blocking("cpu", _load_published_vector_store, get_embedding_model())
+        except Exception as e:
+            logger.warning(f"Could not swap to published vector store: {str(e)}")
+
+async def _build_vector_store_from_storage(components: dict):
+    while True:
+        generation = storage_generation
+        with timed("document_fetch"):
+            documents = await get_documents_from_storage(components)
+        if not documents:
+            await run_blocking("io", _reset_vector_store)
+            store = None
+        else:
+            with timed("index_build"):
+                store = await run_blocking("cpu", _rebuild_vector_store, documents, components["embedding_fn"])
+            logger.info(f"Vector store created with {len(documents)} documents")
+
+        if generation == storage_generation:
+            return store
+        # Storage changed while we were building, and with no index live those writes were not indexed.
+        # Restarting would starve waiters under steady uploads; the index is installed now, so writes from
+        # here on index themselves and only the files changed during the build need catching up.
+        changed = _files_changed_since(generation)
+        if store is not None and changed is not None:
+            await _catch_up_vector_store(components, changed, storage_generation)
+            return vector_store
+        logger.info("Documents changed during the vector store build, rebuilding")
+
+async def _catch_up_vector_store(components: dict, filenames: List[str], generation: int):
+    """Re-read files changed during a build and replace their chunks in the freshly installed index"""
+    with timed("document_fetch"):
+        documents = await get_documents_from_storage(components, set(filenames))
+    # A file written again after `generation` is indexed by that write itself, which may land first
+    replacements = {
+        filename: [] for filename in filenames if storage_changes.get(filename, 0) <= generation
+    }
+    for document in documents:
+        if document.metadata['source'] in replacements:
+            replacements[document.metadata['source']].append(document)
+    with timed("index_build"):
+        await run_blocking("cpu", _replace_documents_in_vector_store, replacements)
+    logger.info(f"Applied {len(replacements)} files changed during the vector store build")
+
+def _clear_vector_store_build(task: asyncio.Task):
+    global vector_store_build
+    if vector_store_build is task:
+        vector_store_build = None
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Vector store build failed: {str(task.exception())}")
+
+def _start_vector_store_build(components: dict) -> asyncio.Task:
+    """Single-flight: every caller shares the one build that is already in progress"""
+    global vector_store_build
+    if vector_store_build is None:
+        vector_store_build = asyncio.create_task(_build_vector_store_from_storage(components))
+        vector_store_build.add_done_callback(_clear_vector_store_build)
+    return vector_store_build
+
+async def get_vector_store(components: dict):
+    """Return the live vector store, building it from storage if none is loaded"""
+    # A rebuild in flight does not block queries while a previous index can still serve them
+    if vector_store is not None:
+        return vector_store
+
+    # Shield the shared build so one disconnecting client cannot cancel it for everyone
+    return await asyncio.shield(_start_vector_store_build(components))
+
+def _indexed_files(store: "FAISS") -> dict:
+    """filename -> (content hash, chunk count) of every file in the index"""
+    return {
+        source: (store.docstore.content_hashes.get(source), len(labels))
+        for source, labels in _source_labels(store).items()
+    }
+
+async def _verify_vector_store_version(components: dict):
+    """Check a warm-started index against the document manifests (content hash and chunk count per file)
+    and re-index only the files that differ; no chunk text is read when they all match"""
+    try:
+        store = vector_store
+        if store is None:
+            return
+        generation = storage_generation
+        expected = {}
+        for manifest in await _load_manifests():
+            # Same precedence as the index build: a Firebase copy shadows a local one of the same name
+            expected.setdefault(manifest['filename'], (manifest['content_hash'], manifest['chunk_count']))
+        indexed = _indexed_files(store)
+        changed = [filename for filename in expected.keys() | indexed.keys()
+                   if expected.get(filename) != indexed.get(filename)]
+        if not changed:
+            logger.info(f"Persisted vector store {vector_store_version} matches the document manifests")
+            return
+
+        logger.info(f"Persisted vector store is out of date for {len(changed)} files, re-indexing them")
+        await _catch_up_vector_store(components, changed, generation)
+    except Exception as e:
+        logger.error(f"Vector store verification failed: {str(e)}")
+
+async def get_documents_from_storage(components: dict, filenames: Optional[set] = None) -> List[Document]:
+    # Not cached: the full chunk list is only needed while an index is built or verified, and holding
+    # it between builds would keep a second copy of the corpus in memory
+    try:
+        return await _get_documents_from_storage(components, filenames)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving documents: {str(e)}")
         raise ValueError(f"Error retrieving documents: {str(e)}")
 
-def _get_documents_from_storage(components: dict) -> List[Document]:
+def _list_firebase_documents() -> List[dict]:
+    # Project away legacy inline 'text'/'chunks' so listing stays cheap
+    docs = db.collection('pdf_documents').select(
+        ['filename', 'content_hash', 'chunk_count', 'sharded', 'chunk_collection']
+    ).stream()
+    return [doc.to_dict() for doc in docs]
+
+def _read_chunk_page(filename: str, chunk_collection: str, start: int, stop: int,
+                     content_hash: Optional[str] = None) -> List[Document]:
+    chunks_ref = db.collection('pdf_documents').document(filename).collection(chunk_collection)
+    docs = chunks_ref.where('index', '>=', start).where('index', '<', stop).stream()
     documents = []
+    for doc in docs:
+        chunk = doc.to_dict()
+        if chunk['text'].strip():
+            metadata = _chunk_metadata(filename, chunk['index'], 'firebase', chunk.get('pages'))
+            if content_hash:
+                metadata['content_hash'] = content_hash
+            documents.append(Document(page_content=chunk['text'], metadata=metadata))
+    return documents
 
-    if db:
-        try:
-            docs = db.collection('pdf_documents').stream()
-            for doc in docs:
-                doc_data = doc.to_dict()
-                filename = doc_data.get('filename', 'Unknown')
-
-                if 'chunks' in doc_data:
-                    for i, chunk in enumerate(doc_data.get('chunks', [])):
-                        if chunk.strip():
-                            documents.append(Document(
-                                page_content=chunk,
-                                metadata={
-                                    'source': filename,
-                                    'chunk_id': i,
-                                    'storage': 'firebase'
-                                }
-                            ))
-                elif 'text' in doc_data:
-                    full_text = doc_data['text']
-                    chunks = components["text_splitter"].split_text(full_text)
-                    for i, chunk in enumerate(chunks):
-                        if chunk.strip():
-                            documents.append(Document(
-                                page_content=chunk,
-                                metadata={
-                                    'source': filename,
-                                    'chunk_id': i,
-                                    'storage': 'firebase'
-                                }
-                            ))
-        except Exception as e:
-            logger.warning(f"Firebase retrieval failed, falling back to mock storage: {str(e)}")
-            documents = []
+def _read_legacy_document(filename: str, components: dict) -> List[Document]:
+    # Documents written before chunk sharding keep chunks (or only text) inline
+    doc_data = db.collection('pdf_documents').document(filename).get().to_dict() or {}
+    if 'chunks' in doc_data:
+        return _chunks_to_documents(filename, doc_data.get('chunks', []), 'firebase',
+                                    content_hash=doc_data.get('content_hash'))
+    if 'text' in doc_data:
+        chunks = components["text_splitter"].split_text(doc_data['text'])
+        return _chunks_to_documents(filename, chunks, 'firebase', content_hash=doc_data.get('content_hash'))
+    return []
 
-    # Always include mock storage documents
-    for doc_data in mock_storage.get_all_documents():
+def _get_local_documents(filenames: Optional[set] = None) -> List[Document]:
+    documents = []
+    for doc_data in chunk_store.get_all_documents():
+        filename = doc_data['filename']
+        if filenames is not None and filename not in filenames:
+            continue
+        chunks, chunk_pages = chunk_store.read_document_chunks(filename, doc_data['chunk_count'])
+        documents.extend(_chunks_to_documents(filename, chunks, 'local', chunk_pages, doc_data['content_hash']))
+    return documents
+
+async def _get_firebase_documents(components: dict, filenames: Optional[set] = None) -> List[Document]:
+    """Read every document's chunks (or only those of `filenames`) in parallel pages, with bounded
+    concurrency on the I/O pool"""
+    semaphore = asyncio.Semaphore(FIRESTORE_READ_CONCURRENCY)
+
+    async def read(fn, *args):
+        async with semaphore:
+            return await run_blocking("io", fn, *args)
+
+    reads = []
+    for doc_data in await run_blocking("io", _list_firebase_documents):
         filename = doc_data.get('filename', 'Unknown')
-        chunks = doc_data.get('chunks', [])
-
-        for i, chunk in enumerate(chunks):
-            if chunk.strip():
-                documents.append(Document(
-                    page_content=chunk,
-                    metadata={
-                        'source': filename,
-                        'chunk_id': i,
-                        'storage': 'mock'
-                    }
+        if filenames is not None and filename not in filenames:
+            continue
+        if doc_data.get('sharded'):
+            for start in range(0, doc_data.get('chunk_count', 0), FIRESTORE_PAGE_SIZE):
+                reads.append(read(
+                    _read_chunk_page, filename, _chunk_collection(doc_data), start, start + FIRESTORE_PAGE_SIZE,
+                    doc_data.get('content_hash')
                 ))
+        else:
+            reads.append(read(_read_legacy_document, filename, components))
+
+    pages = await asyncio.gather(*reads)
+    return [document for page in pages for document in page]
+
+async def _get_documents_from_storage(components: dict, filenames: Optional[set] = None) -> List[Document]:
+    """The complete document set, or only the chunks of `filenames`. A Firestore failure raises: an index
+    built, verified or reset from the local documents alone would drop every Firebase document, for all
+    workers once it is published."""
+    documents = []
+
+    if db:
+        documents = await _get_firebase_documents(components, filenames)
+
+    # Always include locally stored documents
+    documents.extend(await run_blocking("io", _get_local_documents, filenames))
 
     logger.info(f"Retrieved {len(documents)} document chunks")
     return documents
 
-@app.get("/documents")
-async def list_documents():
-    """List all uploaded documents"""
-    documents = []
+# Document manifests: filename, content hash, chunk count, text length, page count and ingest time, written
+# at upload. Listing reads only these, never chunk text, and is cached per storage generation.
+MANIFEST_FIELDS = ('filename', 'content_hash', 'chunk_count', 'text_length', 'page_count', 'ingested_at', 'storage')
+manifest_cache = {"generation": None, "loaded_at": 0.0, "documents": []}
+
+def _backfill_firebase_manifest(doc_ref) -> dict:
+    """Documents stored before manifests keep chunks or text inline: count them once and record the counts"""
+    doc_data = doc_ref.get().to_dict() or {}
+    manifest = {'chunk_count': len(doc_data.get('chunks', [])), 'text_length': len(doc_data.get('text', ''))}
+    doc_ref.update(manifest)
+    return manifest
+
+def _list_firebase_manifests() -> List[dict]:
+    fields = ['filename', 'content_hash', 'chunk_count', 'text_length', 'page_count', 'ingested_at', 'timestamp']
+    manifests = []
+    for doc in db.collection('pdf_documents').select(fields).stream():
+        doc_data = doc.to_dict()
+        if doc_data.get('chunk_count') is None or doc_data.get('text_length') is None:
+            doc_data.update(_backfill_firebase_manifest(doc.reference))
+        ingested_at = doc_data.get('ingested_at')
+        if ingested_at is None and doc_data.get('timestamp') is not None:
+            ingested_at = doc_data['timestamp'].timestamp()
+        manifests.append({
+            'filename': doc_data.get('filename', doc.id),
+            'content_hash': doc_data.get('content_hash'),
+            'chunk_count': doc_data['chunk_count'],
+            'text_length': doc_data['text_length'],
+            'page_count': doc_data.get('page_count'),
+            'ingested_at': ingested_at,
+            'storage': 'firebase'
+        })
+    return manifests
 
+def _list_local_manifests() -> List[dict]:
+    return [{**manifest, 'storage': 'local'} for manifest in chunk_store.get_all_documents()]
+
+async def _load_manifests() -> List[dict]:
+    """All document manifests sorted by filename, from the cache while storage is unchanged"""
+    generation = storage_generation
+    if manifest_cache["generation"] == generation and time.time() - manifest_cache["loaded_at"] < DOCUMENTS_CACHE_TTL:
+        return manifest_cache["documents"]
+
+    manifests = []
     if db:
         try:
-            docs = db.collection('pdf_documents').stream()
-            for doc in docs:
-                doc_data = doc.to_dict()
-                documents.append({
-                    'filename': doc_data.get('filename'),
-                    'chunk_count': len(doc_data.get('chunks', [])),
-                    'text_length': len(doc_data.get('text', '')),
-                    'storage': 'firebase'
-                })
+            manifests = await run_blocking("io", _list_firebase_manifests)
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.warning(f"Firebase listing failed, falling back to mock storage: {str(e)}")
-            documents = []
-
-    # Always include mock storage documents
-    for doc_data in mock_storage.get_all_documents():
-        documents.append({
-            'filename': doc_data.get('filename'),
-            'chunk_count': len(doc_data.get('chunks', [])),
-            'text_length': len(doc_data.get('text', '')),
-            'storage': 'mock'
-        })
+            logger.warning(f"Firebase listing failed, falling back to local storage: {str(e)}")
+            manifests = []
+
+    # Always include locally stored documents
+    manifests.extend(await run_blocking("io", _list_local_manifests))
+    manifests.sort(key=lambda manifest: (manifest['filename'] or '', manifest['storage']))
+
+    # A write during the read leaves the cache stale: serve this result, but do not keep it
+    if generation == storage_generation:
+        manifest_cache.update(generation=generation, loaded_at=time.time(), documents=manifests)
+    return manifests
+
+@app.get("/documents", dependencies=[Depends(wait_until_warm)])
+async def list_documents(fields: Optional[str] = None, offset: int = 0, limit: int = DOCUMENTS_PAGE_SIZE):
+    """List uploaded documents by filename; `fields` is a comma-separated subset of the manifest fields"""
+    selected = MANIFEST_FIELDS
+    if fields:
+        selected = tuple(field.strip() for field in fields.split(',') if field.strip())
+        unknown = [field for field in selected if field not in MANIFEST_FIELDS]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(MANIFEST_FIELDS)}"
+            )
+    if offset < 0 or not 1 <= limit <= DOCUMENTS_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"offset must be >= 0 and limit between 1 and {DOCUMENTS_MAX_PAGE_SIZE}"
+        )
 
+    manifests = await _load_manifests()
+    page = manifests[offset:offset + limit]
     return JSONResponse(content={
-        "documents": documents,
-        "total": len(documents)
+        "documents": [{field: manifest.get(field) for field in selected} for manifest in page],
+        "total": len(manifests),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if offset + limit < len(manifests) else None
     })
 
+# Answer cache for /chat, keyed by normalized query and index version
+class AnswerCache:
+    def __init__(self, max_size: int, ttl: float, similarity_threshold: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(re.findall(r"\w+", query.lower()))
+
+    def _find_similar(self, version: str, embedding, now: float):
+        best_key, best_score = None, self.similarity_threshold
+        for key, (expires_at, cached_embedding, _) in self.entries.items():
+            if key[0] != version or cached_embedding is None or expires_at < now:
+                continue
+            score = float(np.dot(embedding, cached_embedding))
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def get(self, query: str, version: str, embedding=None):
+        key = (version, self.normalize(query))
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self.entries[key]
+                entry = None
+
+            if entry is None and embedding is not None and self.similarity_threshold > 0:
+                key = self._find_similar(version, embedding, now)
+                entry = self.entries.get(key) if key is not None else None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, query: str, version: str, response: dict, embedding=None):
+        key = (version, self.normalize(query))
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, embedding, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY)
+
+async def _embed_query_for_cache(query: str, components: dict):
+    if answer_cache.similarity_threshold <= 0:
+        return None
+    return np.asarray(await run_blocking("io", components["embedding_fn"].embed_query, query), dtype=np.float32)
+
+def _format_source_documents(documents: List[Document]) -> List[dict]:
+    return [
+        {
+            "content": doc.page_content[:200] + "...",  # Truncate for readability
+            "metadata": doc.metadata
+        }
+        for doc in documents
+    ]
+
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _retrieve_for_chat(store: "FAISS", query: str, sources: Optional[List[str]] = None,
+                             query_embedding=None) -> List[Document]:
+    """Retrieve chat context, reusing the answer cache's query embedding when there is one"""
+    retrieve = _hybrid_retrieve if RETRIEVAL_MODE == "hybrid" else _retrieve_documents
+    with timed("retrieval"):
+        retrieved = await run_blocking("io", retrieve, store, query, CHAT_RETRIEVAL_K, None, None, sources,
+                                       query_embedding)
+    return [doc for doc, _ in retrieved]
+
+async def _stream_chat_events(query: str, store: "FAISS", version: str, query_embedding=None,
+                              sources: Optional[List[str]] = None):
+    """Yield retrieved sources first, then LLM tokens as Gemini produces them"""
+    started = time.perf_counter()
+    try:
+        cached = answer_cache.get(query, version, query_embedding)
+        if cached is not None:
+            yield _sse_event("sources", {"source_documents": cached["source_documents"]})
+            yield _sse_event("token", {"text": cached["response"]})
+            yield _sse_event("done", {
+                "response": cached["response"],
+                "query": query,
+                "cached": True,
+                "time_to_first_token": time.perf_counter() - started,
+                "total_time": time.perf_counter() - started
+            })
+            return
+
+        documents = await _retrieve_for_chat(store, query, sources, query_embedding)
+        source_documents = _format_source_documents(documents)
+        yield _sse_event("sources", {"source_documents": source_documents})
+
+        time_to_first_token = None
+        answer_parts = []
+        with timed("llm"):
+            async for text in stream_answer(query, documents):
+                if not text:
+                    continue
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                    observe_stage("time_to_first_token", time_to_first_token)
+                    logger.info(f"Time to first token: {time_to_first_token:.3f}s for query: {query[:50]}...")
+                answer_parts.append(text)
+                yield _sse_event("token", {"text": text})
+
+        total_time = time.perf_counter() - started
+        logger.info(f"Streamed response completed in {total_time:.3f}s for query: {query[:50]}...")
+        answer_cache.put(query, version, {
+            "response": "".join(answer_parts),
+            "source_documents": source_documents
+        }, query_embedding)
+        yield _sse_event("done", {
+            "response": "".join(answer_parts),
+            "query": query,
+            "time_to_first_token": time_to_first_token,
+            "total_time": total_time
+        })
+    except HTTPException as e:
+        yield _sse_event("error", {"error": e.detail, "response": e.detail})
+    except asyncio.TimeoutError:
+        logger.error(f"Gemini timed out streaming query: {query[:50]}...")
+        yield _sse_event("error", {
+            "error": "The language model timed out",
+            "response": "I apologize, but the answer is taking too long. Please try again."
+        })
+    except Exception as e:
+        logger.error(f"Error in streaming chat: {str(e)}")
+        yield _sse_event("error", {
+            "error": f"An error occurred while processing your query: {str(e)}",
+            "response": "I apologize, but I encountered an error while processing your question. Please try again."
+        })
+
 @app.post("/chat")
 async def chat(
     query: str = Form(...),
+    stream: bool = Form(default=False),
+    sources: Optional[List[str]] = Form(default=None),
     components: dict = Depends(get_components)
 ):
-    global vector_store
-    
     if not query or query.strip() == "":
         raise HTTPException(status_code=400, detail="Query cannot be empty")
     
     try:
-        # Get or create vector store
-        if vector_store is None:
-            documents = await get_documents_from_storage(components)
-            
-            if not documents:
-                return JSONResponse(
-                    content={
-                        "response": "No documents have been uploaded yet. Please upload a PDF document first.",
-                        "source_documents": []
-                    },
-                    status_code=200
-                )
-            
-            # Create vector store in a separate thread
-            loop = asyncio.get_event_loop()
-            with concurrent.futures.ThreadPoolExecutor() as pool:
-                vector_store = await loop.run_in_executor(
-                    pool,
-                    lambda: FAISS.from_documents(documents, components["embedding_fn"])
-                )
-            
-            logger.info(f"Vector store created with {len(documents)} documents")
-        
-        # Enhanced retrieval with more relevant documents
-        retriever = vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 5}  # Retrieve top 5 most relevant chunks
-        )
+        # Get or create vector store; includes the document fetch and index build if one is needed
+        with timed("index_wait"):
+            store = await get_vector_store(components)
+        if store is None:
+            return JSONResponse(
+                content={
+                    "response": "No documents have been uploaded yet. Please upload a PDF document first.",
+                    "source_documents": []
+                },
+                status_code=200
+            )
         
-        # Create enhanced QA chain with custom prompt
-        qa_prompt = get_qa_prompt()
+        # Answers scoped to some sources are cached separately from unscoped ones
+        version = vector_store_version if not sources else f"{vector_store_version}|{'|'.join(sorted(sources))}"
+        with timed("query_embedding"):
+            query_embedding = await _embed_query_for_cache(query, components)
         
-        chain = RetrievalQA.from_chain_type(
-            llm=get_gemini_llm(),
-            chain_type="stuff",
-            retriever=retriever,
-            chain_type_kwargs={"prompt": qa_prompt},
-            return_source_documents=True
-        )
-
-        # Run query in a separate thread
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            result = await loop.run_in_executor(
-                pool,
-                lambda: chain({"query": query})
+        if stream:
+            return StreamingResponse(
+                _stream_chat_events(query, store, version, query_embedding, sources),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
             )
         
-        # Format source documents for response
-        source_docs = []
-        if "source_documents" in result:
-            for doc in result["source_documents"]:
-                source_docs.append({
-                    "content": doc.page_content[:200] + "...",  # Truncate for readability
-                    "metadata": doc.metadata
-                })
+        cached = answer_cache.get(query, version, query_embedding)
+        if cached is not None:
+            logger.info(f"Answer cache hit for query: {query[:50]}...")
+            return JSONResponse(content={**cached, "query": query, "cached": True})
+        
+        # Retrieval runs on the I/O pool; Gemini is awaited natively, holding no thread while it thinks
+        documents = await _retrieve_for_chat(store, query, sources, query_embedding)
+        with timed("llm"):
+            answer = await generate_answer(query, documents)
         
         response_data = {
-            "response": result["result"],
-            "source_documents": source_docs,
+            "response": answer,
+            "source_documents": _format_source_documents(documents),
             "query": query
         }
+        answer_cache.put(query, version, {
+            "response": response_data["response"],
+            "source_documents": response_data["source_documents"]
+        }, query_embedding)
         
         logger.info(f"Query processed successfully: {query[:50]}...")
         return JSONResponse(content=response_data)
 
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        logger.error(f"Gemini timed out for query: {query[:50]}...")
+        return JSONResponse(
+            content={
+                "error": "The language model timed out",
+                "response": "I apologize, but the answer is taking too long. Please try again."
+            },
+            status_code=504
+        )
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
         return JSONResponse(
@@ -532,44 +3391,173 @@ async def chat(
 async def similarity_search(
     query: str = Form(...),
     k: int = Form(default=3),
+    nprobe: Optional[int] = Form(default=None),
+    ef_search: Optional[int] = Form(default=None),
+    sources: Optional[List[str]] = Form(default=None),
+    hybrid: bool = Form(default=False),
     components: dict = Depends(get_components)
 ):
-    """Perform similarity search without LLM generation"""
-    global vector_store
-    
+    """Perform similarity search without LLM generation; nprobe/ef_search tune IVF and HNSW indexes,
+    sources restricts the search to chunks of those files and hybrid fuses in BM25 keyword matches
+    (scores are then RRF scores, higher is better, instead of L2 distances)"""
     try:
-        if vector_store is None:
-            documents = await get_documents_from_storage(components)
-            if not documents:
-                return JSONResponse(content={"error": "No documents available"}, status_code=404)
-            
-            loop = asyncio.get_event_loop()
-            with concurrent.futures.ThreadPoolExecutor() as pool:
-                vector_store = await loop.run_in_executor(
-                    pool,
-                    lambda: FAISS.from_documents(documents, components["embedding_fn"])
-                )
+        store = await get_vector_store(components)
+        if store is None:
+            return JSONResponse(content={"error": "No documents available"}, status_code=404)
         
         # Perform similarity search
-        docs = vector_store.similarity_search(query, k=k)
+        retrieve = _hybrid_retrieve if hybrid else _retrieve_documents
+        docs = await run_blocking("io", retrieve, store, query, k, nprobe, ef_search, sources)
         
         results = []
-        for doc in docs:
+        for doc, distance in docs:
             results.append({
                 "content": doc.page_content,
-                "metadata": doc.metadata
+                "metadata": doc.metadata,
+                "score": distance
             })
         
         return JSONResponse(content={
             "query": query,
             "results": results,
-            "count": len(results)
+            "count": len(results),
+            "index_type": _index_type_name(store.index),
+            "hybrid": hybrid
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in similarity search: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Batch endpoints: one embedding call and one FAISS search for the whole list of queries
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    k: int = 3
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    sources: Optional[List[str]] = None
+    hybrid: bool = False
+
+class BatchChatRequest(BaseModel):
+    queries: List[str]
+    sources: Optional[List[str]] = None
+    generate: bool = True  # False returns only the retrieved sources
+    concurrency: Optional[int] = None
+
+def _validate_batch_queries(queries: List[str]):
+    if not queries:
+        raise HTTPException(status_code=400, detail="queries cannot be empty")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    if any(not query or not query.strip() for query in queries):
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+@app.post("/similarity-search/batch")
+async def similarity_search_batch(request: BatchSearchRequest, components: dict = Depends(get_components)):
+    """Similarity search for many queries at once"""
+    _validate_batch_queries(request.queries)
+    try:
+        store = await get_vector_store(components)
+        if store is None:
+            return JSONResponse(content={"error": "No documents available"}, status_code=404)
+
+        hits, _ = await run_blocking(
+            "io", _retrieve_documents_batch, store, request.queries, request.k,
+            request.nprobe, request.ef_search, request.sources, request.hybrid
+        )
+        results = [
+            {
+                "query": query,
+                "results": [
+                    {"content": doc.page_content, "metadata": doc.metadata, "score": score}
+                    for doc, score in query_hits
+                ]
+            }
+            for query, query_hits in zip(request.queries, hits)
+        ]
+        return JSONResponse(content={
+            "results": results,
+            "count": len(results),
+            "index_type": _index_type_name(store.index),
+            "hybrid": request.hybrid
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in batch similarity search: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/chat/batch")
+async def chat_batch(request: BatchChatRequest, components: dict = Depends(get_components)):
+    """Answer many queries at once; retrieval is batched and Gemini calls run with bounded concurrency"""
+    _validate_batch_queries(request.queries)
+    try:
+        store = await get_vector_store(components)
+        if store is None:
+            return JSONResponse(
+                content={
+                    "error": "No documents have been uploaded yet. Please upload a PDF document first.",
+                    "results": []
+                },
+                status_code=200
+            )
+
+        sources = request.sources
+        version = vector_store_version if not sources else f"{vector_store_version}|{'|'.join(sorted(sources))}"
+        started = time.perf_counter()
+        hits, query_vectors = await run_blocking(
+            "io", _retrieve_documents_batch, store, request.queries, CHAT_RETRIEVAL_K,
+            None, None, sources, RETRIEVAL_MODE == "hybrid"
+        )
+        use_embeddings = answer_cache.similarity_threshold > 0
+
+        semaphore = asyncio.Semaphore(max(1, min(request.concurrency or BATCH_LLM_CONCURRENCY, BATCH_LLM_CONCURRENCY)))
+
+        async def answer(query: str, query_hits: List[tuple], query_vector) -> dict:
+            documents = [doc for doc, _ in query_hits]
+            source_documents = _format_source_documents(documents)
+            if not request.generate:
+                return {"query": query, "source_documents": source_documents}
+
+            embedding = query_vector if use_embeddings else None
+            cached = answer_cache.get(query, version, embedding)
+            if cached is not None:
+                return {**cached, "query": query, "cached": True}
+
+            try:
+                async with semaphore:
+                    text = await generate_answer(query, documents)
+            except Exception as e:
+                logger.error(f"Error answering batch query {query[:50]}...: {str(e) or type(e).__name__}")
+                return {"query": query, "error": str(e) or type(e).__name__, "source_documents": source_documents}
+
+            response = {"response": text, "source_documents": source_documents}
+            answer_cache.put(query, version, response, embedding)
+            return {**response, "query": query}
+
+        results = await asyncio.gather(*(
+            answer(query, query_hits, query_vector)
+            for query, query_hits, query_vector in zip(request.queries, hits, query_vectors)
+        ))
+        logger.info(f"Answered batch of {len(results)} queries in {time.perf_counter() - started:.3f}s")
+        return JSONResponse(content={
+            "results": results,
+            "count": len(results),
+            "failed": sum(1 for result in results if "error" in result)
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in batch chat endpoint: {str(e)}")
+        return JSONResponse(
+            content={"error": f"An error occurred while processing the batch: {str(e)}", "results": []},
+            status_code=500
+        )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
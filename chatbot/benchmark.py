@@ -0,0 +1,239 @@
+"""Offline benchmark for the RAG API: no Gemini key or Firebase project needed.
+
+Gemini is replaced by a fake chat model with configurable latency and
+Firestore by the local chunk store. Synthetic PDFs are generated on the
+fly, and requests go through the ASGI app in-process, so the numbers cover
+the app itself (extraction, embedding, FAISS, chains) without network noise.
+Reports throughput and p50/p95/p99 latency for /upload-pdf, the index build,
+/similarity-search and /chat at each concurrency level. Requests shed with
+429 or 503 by admission control are counted as rejections, not errors;
+latency and throughput cover the requests that were served.
+
+    python benchmark.py --documents 20 --pages 10 --concurrency 1 4 16 --llm-latency 0.5
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Optional, Union
+
+import numpy as np
+
+# Keep the benchmark's index, embedding cache, chunk store and uploads away from the real ones
+WORK_DIR = tempfile.mkdtemp(prefix="geminy-bench-")
+for name in ("VECTOR_INDEX_DIR", "EMBEDDING_CACHE_DIR", "UPLOADS_DIR", "CHUNK_STORE_DIR"):
+    os.environ[name] = os.path.join(WORK_DIR, name.lower())
+# No credentials file there, so the warmup falls back to the local chunk store
+os.environ["FIREBASE_CRED_PATH"] = os.path.join(WORK_DIR, "no-firebase-credentials.json")
+
+import fitz
+import httpx
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import Callbacks
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import Geminy
+
+WORDS = (
+    "election ward candidate polling booth voter list officer nomination ballot counting "
+    "constituency municipal council returning scrutiny symbol party independent turnout "
+    "circular notice schedule deposit affidavit withdrawal recount result declaration"
+).split()
+ANSWER = "The returning officer announced the schedule for ward nominations and scrutiny."
+# Overload responses: the server is shedding load, which is a result to report rather than a failure
+REJECTION_STATUSES = (429, 503)
+
+
+class FakeGeminiLLM(BaseChatModel):
+    """Chat model that waits `latency` seconds and streams a fixed answer word by word"""
+
+    latency: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=ANSWER))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=ANSWER))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for word in ANSWER.split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+# BaseChatModel leaves some annotations as forward references; resolve them for the subclass
+FakeGeminiLLM.model_rebuild(_types_namespace={"Union": Union, "Optional": Optional,
+                                              "BaseCache": BaseCache, "Callbacks": Callbacks})
+
+
+def make_pdf(rng, pages, words_per_page):
+    """A PDF of random election-flavoured text with a unique ward number per page"""
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        words = [rng.choice(WORDS) for _ in range(words_per_page)]
+        words.insert(0, f"ward {rng.randint(1, 999)} page {page_number + 1}")
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), "\n".join(lines), fontsize=8)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def summarize(latencies, wall_time, rejected=0):
+    """Throughput and percentiles over served requests; rejected ones only count towards the rejection rate"""
+    latencies = np.asarray(latencies) * 1000
+    requests = len(latencies) + rejected
+    return {
+        "requests": requests,
+        "rejected": rejected,
+        "rejection_rate": rejected / requests if requests else 0.0,
+        "throughput": len(latencies) / wall_time if wall_time else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else float("nan"),
+        "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else float("nan"),
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else float("nan"),
+    }
+
+
+def report(stage, concurrency, stats):
+    print(
+        f"{stage:>18} c={concurrency:<4} n={stats['requests']:<5} {stats['throughput']:8.2f} req/s"
+        f"  p50 {stats['p50_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms"
+        f"  rejected {stats['rejected']} ({stats['rejection_rate']:.1%})"
+    )
+
+
+async def run_concurrently(concurrency, requests):
+    """Run the request coroutine factories with at most `concurrency` in flight.
+
+    Returns the latencies of served requests, the number rejected with 429/503 and the wall time;
+    any other error status aborts the run.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    rejected = 0
+
+    async def timed(make_request):
+        nonlocal rejected
+        async with semaphore:
+            started = time.perf_counter()
+            response = await make_request()
+            elapsed = time.perf_counter() - started
+            if response.status_code in REJECTION_STATUSES:
+                rejected += 1
+                return
+            if response.status_code >= 400:
+                raise RuntimeError(f"{response.request.url.path} returned {response.status_code}: {response.text[:200]}")
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(make_request) for make_request in requests))
+    return latencies, rejected, time.perf_counter() - started
+
+
+async def benchmark(args):
+    rng = random.Random(args.seed)
+    Geminy.db = None
+    Geminy.get_gemini_llm = lambda: FakeGeminiLLM(latency=args.llm_latency)
+    Geminy.answer_cache.max_size = 0 if args.no_answer_cache else Geminy.answer_cache.max_size
+    results = []
+
+    async with Geminy.app.router.lifespan_context(Geminy.app):
+        transport = httpx.ASGITransport(app=Geminy.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for concurrency in args.concurrency:
+                await client.delete("/delete-all-data")
+                pdfs = [make_pdf(rng, args.pages, args.words_per_page) for _ in range(args.documents)]
+                uploads = [
+                    lambda i=i, data=data: client.post(
+                        "/upload-pdf", files={"file": (f"bench-{concurrency}-{i}.pdf", io.BytesIO(data), "application/pdf")}
+                    )
+                    for i, data in enumerate(pdfs)
+                ]
+                latencies, rejected, wall_time = await run_concurrently(concurrency, uploads)
+                results.append({"stage": "upload-pdf", "concurrency": concurrency,
+                                **summarize(latencies, wall_time, rejected)})
+                report("upload-pdf", concurrency, results[-1])
+
+                started = time.perf_counter()
+                store = await Geminy.get_vector_store(await Geminy.get_components())
+                build_time = time.perf_counter() - started
+                if store is None:
+                    print(f"{'index-build':>18} c={concurrency:<4} skipped: every upload was rejected")
+                    continue
+                chunks = len(store.index_to_docstore_id)
+                results.append({
+                    "stage": "index-build", "concurrency": concurrency, "chunks": chunks,
+                    "seconds": build_time, "chunks_per_second": chunks / build_time,
+                    "index_type": Geminy._index_type_name(store.index)
+                })
+                print(f"{'index-build':>18} c={concurrency:<4} {chunks} chunks in {build_time:.2f}s "
+                      f"({chunks / build_time:.1f} chunks/s, {results[-1]['index_type']})")
+
+                queries = [
+                    f"ward {rng.randint(1, 999)} " + " ".join(rng.choice(WORDS) for _ in range(5))
+                    for _ in range(args.requests)
+                ]
+                searches = [
+                    lambda query=query: client.post("/similarity-search", data={"query": query, "k": args.k})
+                    for query in queries
+                ]
+                latencies, rejected, wall_time = await run_concurrently(concurrency, searches)
+                results.append({"stage": "similarity-search", "concurrency": concurrency,
+                                **summarize(latencies, wall_time, rejected)})
+                report("similarity-search", concurrency, results[-1])
+
+                chats = [
+                    lambda query=query: client.post("/chat", data={"query": query, "stream": args.stream})
+                    for query in queries
+                ]
+                latencies, rejected, wall_time = await run_concurrently(concurrency, chats)
+                results.append({"stage": "chat", "concurrency": concurrency,
+                                **summarize(latencies, wall_time, rejected)})
+                report("chat", concurrency, results[-1])
+
+            await client.delete("/delete-all-data")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10, help="PDFs uploaded per concurrency level")
+    parser.add_argument("--pages", type=int, default=10, help="pages per synthetic PDF")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--requests", type=int, default=100, help="search and chat requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the fake Gemini takes per answer")
+    parser.add_argument("--stream", action="store_true", help="benchmark /chat with stream=true")
+    parser.add_argument("--no-answer-cache", action="store_true", help="disable the answer cache")
+    parser.add_argument("-k", type=int, default=3, help="k for /similarity-search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    print(f"Working directory: {WORK_DIR}", file=sys.stderr)
+    try:
+        results = asyncio.run(benchmark(args))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Compare an embedding backend against the default PyTorch backend.
+
+Embeds the chunks of the given PDFs with both backends and reports
+throughput and recall@k: how many of the reference top-k neighbours the
+candidate backend also returns for the same queries.
+
+    python embedding_parity.py --backend onnx-int8 --batch-size 64 docs/*.pdf
+"""
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from Geminy import (
+    _assemble_pdf_text,
+    _count_pdf_pages,
+    _extract_page_range,
+    create_embedding_backend,
+    get_text_splitter,
+)
+
+
+def load_chunks(paths):
+    chunks = []
+    for path in paths:
+        pages = _extract_page_range(path, 0, _count_pdf_pages(path))
+        chunks.extend(get_text_splitter().split_text(_assemble_pdf_text(pages)['text']))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def embed(backend, texts, batch_size, threads):
+    model = create_embedding_backend(backend, batch_size=batch_size, threads=threads)
+    model.embed_documents(texts[:batch_size])  # warm up before timing
+    started = time.perf_counter()
+    vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+    return vectors, time.perf_counter() - started
+
+
+def top_k(queries, corpus, k):
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="+", help="PDF files to build the test corpus from")
+    parser.add_argument("--backend", default="onnx-int8", help="candidate backend: onnx or onnx-int8")
+    parser.add_argument("--reference", default="torch", help="reference backend")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200, help="number of chunks sampled as queries")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--min-recall", type=float, default=0.9, help="exit non-zero below this recall@k")
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.pdfs)
+    if len(chunks) <= args.k:
+        sys.exit(f"Need more than {args.k} chunks, got {len(chunks)}")
+
+    # Queries are chunk prefixes, so each has a meaningful neighbourhood in the corpus
+    random.seed(0)
+    queries = [chunk[:200] for chunk in random.sample(chunks, min(args.queries, len(chunks)))]
+
+    results = {}
+    for backend in (args.reference, args.backend):
+        corpus, seconds = embed(backend, chunks, args.batch_size, args.threads)
+        query_vectors, _ = embed(backend, queries, args.batch_size, args.threads)
+        results[backend] = (corpus, query_vectors)
+        print(f"{backend:>10}: {len(chunks)} chunks in {seconds:.2f}s ({len(chunks) / seconds:.1f} chunks/s)")
+
+    reference_corpus, reference_queries = results[args.reference]
+    candidate_corpus, candidate_queries = results[args.backend]
+    reference_top = top_k(reference_queries, reference_corpus, args.k)
+    candidate_top = top_k(candidate_queries, candidate_corpus, args.k)
+    recall = np.mean([
+        len(set(ref_row) & set(cand_row)) / args.k
+        for ref_row, cand_row in zip(reference_top, candidate_top)
+    ])
+    cosine = float(np.mean(np.sum(reference_corpus * candidate_corpus, axis=1)))
+
+    print(f"recall@{args.k}: {recall:.3f}")
+    print(f"mean cosine between backends: {cosine:.4f}")
+    if recall < args.min_recall:
+        sys.exit(f"recall@{args.k} {recall:.3f} is below {args.min_recall}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,7 @@ const ChatComponent: React.FC<ChatComponentProps> = ({ onClose }) => {
   const [messages, setMessages] = useState<Message[]>([]);
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [streamingMessageId, setStreamingMessageId] = useState<string | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   const scrollToBottom = () => {
@@ -29,6 +30,55 @@ const ChatComponent: React.FC<ChatComponentProps> = ({ onClose }) => {
     scrollToBottom();
   }, [messages]);
 
+  // Reads Server-Sent Events from /chat and grows the bot message as tokens arrive
+  const readChatStream = async (response: Response, botMessageId: string) => {
+    const reader = response.body!.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    const appendText = (text: string, replace = false) => {
+      setMessages((prev) =>
+        prev.map((message) =>
+          message.id === botMessageId
+            ? { ...message, text: replace ? text : message.text + text }
+            : message
+        )
+      );
+    };
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      const events = buffer.split('\n\n');
+      buffer = events.pop() || '';
+
+      for (const rawEvent of events) {
+        const eventLine = rawEvent.split('\n').find((line) => line.startsWith('event: '));
+        const dataLine = rawEvent.split('\n').find((line) => line.startsWith('data: '));
+        if (!eventLine || !dataLine) continue;
+
+        const event = eventLine.slice(7);
+        const data = JSON.parse(dataLine.slice(6));
+
+        if (event === 'sources') {
+          console.log('Chat sources received:', data.source_documents?.length || 0);
+        } else if (event === 'token') {
+          setStreamingMessageId(botMessageId);
+          appendText(data.text);
+        } else if (event === 'done') {
+          console.log('Chat stream completed:', {
+            timeToFirstToken: data.time_to_first_token,
+            totalTime: data.total_time,
+          });
+        } else if (event === 'error') {
+          appendText(data.response || data.error, true);
+        }
+      }
+    }
+  };
+
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
     
@@ -48,6 +98,7 @@ const ChatComponent: React.FC<ChatComponentProps> = ({ onClose }) => {
     try {
       const formData = new FormData();
       formData.append('query', input);
+      formData.append('stream', 'true');
 
       console.log('Sending query:', input);
 
@@ -56,6 +107,17 @@ const ChatComponent: React.FC<ChatComponentProps> = ({ onClose }) => {
         body: formData,
       });
 
+      const botMessageId = (Date.now() + 1).toString();
+
+      if (response.headers.get('content-type')?.includes('text/event-stream')) {
+        setMessages((prev) => [
+          ...prev,
+          { id: botMessageId, text: '', sender: 'bot', timestamp: new Date() },
+        ]);
+        await readChatStream(response, botMessageId);
+        return;
+      }
+
       const data = await response.json();
 
       console.log('Chat response received:', {
@@ -65,7 +127,7 @@ const ChatComponent: React.FC<ChatComponentProps> = ({ onClose }) => {
       });
 
       const botMessage: Message = {
-        id: (Date.now() + 1).toString(),
+        id: botMessageId,
         text: data.response || data.error || 'Sorry, I could not process your request.',
         sender: 'bot',
         timestamp: new Date(),
@@ -83,6 +145,7 @@ const ChatComponent: React.FC<ChatComponentProps> = ({ onClose }) => {
       setMessages((prev) => [...prev, errorMessage]);
     } finally {
       setIsLoading(false);
+      setStreamingMessageId(null);
     }
   };
 
@@ -293,7 +356,7 @@ const ChatComponent: React.FC<ChatComponentProps> = ({ onClose }) => {
           </div>
         )}
         
-        {messages.map((message) => (
+        {messages.filter((message) => message.text).map((message) => (
           <div
             key={message.id}
             style={{
@@ -323,7 +386,7 @@ const ChatComponent: React.FC<ChatComponentProps> = ({ onClose }) => {
           </div>
         ))}
         
-        {isLoading && (
+        {isLoading && !streamingMessageId && (
           <div style={styles.loadingContainer}>
             <div style={styles.loadingBubble}>
               <span style={styles.loadingDot}></span>